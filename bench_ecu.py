@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''Checks and benchmarks of the ECU model and the vehicles database
+
+Run from the ddt4all directory, e.g. python bench_ecu.py --benchdecode
+'''
+import argparse
+import json
+import os
+import time
+import zipfile
+
+from ecu import *
+from ecu import _
+
+
+def get_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+
+def test_database(compiled, snapshot):
+    start = time.time()
+    db = Ecu_database(compiled=compiled, snapshot=snapshot)
+    elapsed = time.time() - start
+    print("DB %s %i targets %.1f ms RSS %.1f MB" % ("compiled" if db.targets.dbfile else "json", len(db.targets),
+                                                   elapsed * 1000., get_rss() / 1048576.))
+    return db
+
+
+def benchmark_database(runs=5):
+    import subprocess
+    import sys
+
+    def run(flags):
+        results = []
+        for i in range(runs):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--testdb"] + flags,
+                                 capture_output=True, text=True).stdout
+            line = [l for l in out.splitlines() if l.startswith("DB ")][-1].split()
+            results.append((line[1], float(line[4]), float(line[7])))
+        return results
+
+    if not ecu_zip.exists():
+        print(_("Cannot find ecu.zip"))
+        return
+    compile_database()
+    for title, flags in (("db.json", ["--jsondb", "--nosnapshot"]), ("Compiled", ["--nosnapshot"]),
+                         ("Snapshot", [])):
+        results = run(flags)
+        warm = sorted(r[1] for r in results[1:])
+        print("%-10s (%s) cold %7.1f ms, warm %7.1f ms, RSS %6.1f MB" % (title, results[0][0], results[0][1],
+                                                                         warm[len(warm) // 2], results[-1][2]))
+
+
+def benchmark_identify(vehicles=50):
+    import random
+
+    def linear_identify(targets, diagversion, supplier, soft, version, protocol):
+        # The walk check_ecu2 used to do over all the targets
+        approximate_ecu = []
+        targetNum = 0
+        for target in targets:
+            if target.protocol == "CAN" and protocol != "CAN":
+                continue
+            if target.protocol.startswith("KWP") and protocol != "KWP":
+                continue
+            if target.checkWith(diagversion, supplier, soft, version, target.addr):
+                return target, targetNum, None, True
+            elif target.checkApproximate(diagversion, supplier, soft, target.addr):
+                approximate_ecu.append(target)
+            targetNum += 1
+
+        min_delta_version = 0xFFFFFF
+        kept_ecu = None
+        for tgt in approximate_ecu:
+            if get_ecu_protocol(tgt.protocol) != protocol:
+                continue
+            try:
+                int_version = int('0x' + version, 16)
+                int_tgt_version = int('0x' + tgt.version, 16)
+            except ValueError:
+                continue
+            delta = abs(int_tgt_version - int_version)
+            if delta < min_delta_version:
+                min_delta_version = delta
+                kept_ecu = tgt
+        return None, 0, kept_ecu, len(approximate_ecu) > 0
+
+    def indexed_identify(matcher, diagversion, supplier, soft, version, protocol):
+        target, targetNum = matcher.match(diagversion, supplier, soft, version, protocol)
+        if target is not None:
+            return target, targetNum, None, True
+        if not matcher.has_approximate(supplier, soft, protocol):
+            return None, 0, None, False
+        return None, 0, matcher.nearest(supplier, soft, version, protocol), True
+
+    random.seed(0)
+    if ecu_zip.exists():
+        targets = list(Ecu_database().targets)
+    else:
+        # No database here, use a synthetic one of the same order of magnitude
+        targets = []
+        for i in range(40000):
+            targets.append(Ecu_ident("%i" % random.randint(1, 12), "SUP%i" % random.randint(0, 60),
+                                     "%04X" % random.randint(0, 300), "%04X" % random.randint(0, 9999),
+                                     "ECU_%i" % i, "Group %i" % (i % 40), "ECU_%i.json" % i,
+                                     random.choice(["CAN", "KWP2000 FastInit MonoPoint", "ISO8"]),
+                                     [], "%02X" % random.randint(0, 120), True))
+
+    # Identification frames of a vehicle : known ECUs, other versions and unknown ones
+    frames = []
+    for i in range(vehicles * 40):
+        t = random.choice(targets)
+        protocol = get_ecu_protocol(t.protocol)
+        kind = random.randint(0, 2)
+        if kind == 0:
+            frames.append((t.diagversion, t.supplier, t.soft, t.version, protocol))
+        elif kind == 1:
+            frames.append(("%i" % random.randint(1, 12), t.supplier, t.soft, "%04X" % random.randint(0, 9999),
+                           protocol))
+        else:
+            frames.append(("%i" % random.randint(1, 12), "SUP%i" % random.randint(0, 99),
+                           "%04X" % random.randint(0, 300), "%04X" % random.randint(0, 9999),
+                           random.choice(["CAN", "KWP"])))
+
+    start = time.time()
+    matcher = Ecu_matcher(targets)
+    build = time.time() - start
+
+    start = time.time()
+    new = [indexed_identify(matcher, *f) for f in frames]
+    new_time = time.time() - start
+
+    old_frames = frames[:200]
+    start = time.time()
+    old = [linear_identify(targets, *f) for f in old_frames]
+    old_time = (time.time() - start) * len(frames) / len(old_frames)
+
+    diffs = sum(1 for a, b in zip(old, new) if a != b)
+    print("Identify %i frames over %i targets, %i differences on %i checked" % (len(frames), len(targets), diffs,
+                                                                                len(old_frames)))
+    print("Linear  : %8.1f ms per vehicle" % (old_time * 1000. / vehicles))
+    print("Indexed : %8.1f ms per vehicle (index built in %.1f ms)" % (new_time * 1000. / vehicles, build * 1000.))
+
+
+def benchmark_decode():
+    import random
+
+    random.seed(0)
+    streams = []
+    for i in range(64):
+        data = [random.randint(0, 255) for j in range(random.randint(2, 12))]
+        stream = "".join("%02X" % b for b in data)
+        if i % 2:
+            stream = " ".join("%02X" % b for b in data)
+        streams.append(stream)
+
+    data = Ecu_data(None, 'bench')
+    dataitem = Data_item({}, '', 'bench')
+    checked = 0
+    fallback = 0
+    cases = []
+    for endian in ("Big", "Little"):
+        dataitem.endian = endian
+        for firstbyte in range(1, 5):
+            for bitoffset in range(8):
+                for bitscount in range(1, 33):
+                    if not get_extraction_plan(firstbyte, bitoffset, bitscount, endian == "Little"):
+                        fallback += 1
+                        continue
+                    dataitem.firstbyte = firstbyte
+                    dataitem.bitoffset = bitoffset
+                    data.bitscount = bitscount
+                    for stream in streams:
+                        ref = data.getHexValueFromString(stream, dataitem, '')
+                        if data.getHexValue(stream, dataitem, '') != ref:
+                            print("Mismatch", endian, firstbyte, bitoffset, bitscount, stream)
+                            return
+                        checked += 1
+                    cases.append((endian, firstbyte, bitoffset, bitscount))
+
+    print("Checked %i decodes, %i layouts left to the string path" % (checked, fallback))
+
+    stream = "62 01 02 03 04 05 06 07 08 09 0A 0B 0C"
+    data.scaled = True
+    data.step = 0.5
+    data.format = "2.1"
+    for method in ("getHexValueFromString", "getHexValue", "getDisplayValue"):
+        func = getattr(data, method)
+        count = 0
+        start = time.perf_counter()
+        for endian, firstbyte, bitoffset, bitscount in cases:
+            dataitem.endian = endian
+            dataitem.firstbyte = firstbyte
+            dataitem.bitoffset = bitoffset
+            data.bitscount = bitscount
+            for i in range(20):
+                func(stream, dataitem, '')
+                count += 1
+        elapsed = time.perf_counter() - start
+        print("%-22s %.2f us per decoded item" % (method, elapsed * 1e6 / count))
+
+
+def benchmark_encode():
+    data = Ecu_data(None, 'bench')
+    dataitem = Data_item({}, '', 'bench')
+    checked = 0
+    cases = []
+    for endian in ("Big", "Little"):
+        dataitem.endian = endian
+        for firstbyte in range(1, 5):
+            for bitoffset in range(8):
+                for bitscount in range(1, 33):
+                    dataitem.firstbyte = firstbyte
+                    dataitem.bitoffset = bitoffset
+                    data.bitscount = bitscount
+                    for value in (0, 1, 0x5A5A5A5A & ((1 << bitscount) - 1), (1 << bitscount) - 1):
+                        stream = ["A5"] * 10
+                        ref = data.setValueToString(value, list(stream), dataitem, endian == "Little")
+                        if data.setValue("%X" % value, stream, dataitem, '') != ref:
+                            print("Mismatch", endian, firstbyte, bitoffset, bitscount, value)
+                            return
+                        checked += 1
+                    cases.append((endian, firstbyte, bitoffset, bitscount))
+
+    print("Checked %i encodes" % checked)
+
+    for method in ("setValueToString", "setValue", "setValueBytes"):
+        count = 0
+        start = time.perf_counter()
+        for endian, firstbyte, bitoffset, bitscount in cases:
+            dataitem.endian = endian
+            dataitem.firstbyte = firstbyte
+            dataitem.bitoffset = bitoffset
+            data.bitscount = bitscount
+            for i in range(20):
+                if method == "setValueToString":
+                    data.setValueToString(data.encodeValue("1"), ["A5"] * 10, dataitem, endian == "Little")
+                elif method == "setValue":
+                    data.setValue("1", ["A5"] * 10, dataitem, '')
+                else:
+                    data.setValueBytes("1", bytearray(10), dataitem, '')
+                count += 1
+        elapsed = time.perf_counter() - start
+        print("%-22s %.2f us per encoded item" % (method, elapsed * 1e6 / count))
+
+
+def benchmark_memory():
+    import gc
+    import tempfile
+    import tracemalloc
+
+    def report(title):
+        gc.collect()
+        counts = {}
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            if name in ("Ecu_ident", "Ecu_request", "Ecu_data", "Data_item", "Ecu_device", "dict"):
+                counts[name] = counts.get(name, 0) + 1
+        current, peak = tracemalloc.get_traced_memory()
+        print("%-24s RSS %7.1f MB, traced %7.1f MB, %s" % (title, get_rss() / 1048576., current / 1048576.,
+                                                           ", ".join("%s: %i" % kv for kv in sorted(counts.items()))))
+
+    tracemalloc.start()
+    report("Startup")
+
+    start = time.time()
+    keep = []
+    if os.path.exists("ecu.zip"):
+        keep.append(Ecu_database())
+        report("Database")
+        with zipfile.ZipFile("ecu.zip") as zf:
+            infos = [i for i in zf.infolist() if i.filename.endswith(".json") and i.filename != "db.json"]
+        for info in sorted(infos, key=lambda i: i.file_size)[-5:]:
+            keep.append(Ecu_file(info.filename, True))
+        report("Largest ECU files")
+    else:
+        # No database here, use a synthetic one of the same order of magnitude
+        for i in range(40000):
+            keep.append(Ecu_ident("%02X" % (i % 256), "SUP%i" % (i % 50), "%04X" % i, "%04X" % (i * 7 % 65536),
+                                  "ECU_%i" % i, "Group %i" % (i % 40), "ECU_%i.json" % i, "CAN",
+                                  ["X%i" % (i % 30)], "%02X" % (i % 120)))
+        report("Database (synthetic)")
+
+        data = {}
+        requests = []
+        for r in range(800):
+            items = {}
+            for d in range(15):
+                name = "Data %i" % ((r * 15 + d) % 6000)
+                items[name] = {'firstbyte': 3 + d, 'bitoffset': d % 8}
+                data[name] = {'bitscount': 8 + d % 9, 'scaled': d % 2 == 0, 'step': 0.5, 'unit': 'km'}
+            requests.append({'name': "Request %i" % r, 'sentbytes': "21%02X" % (r % 256),
+                             'deny_sds': ['plant'], 'receivebyte_dataitems': items})
+        ecudict = {'devices': [], 'requests': requests, 'data': data, 'endian': ''}
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(ecudict, f)
+        for i in range(5):
+            keep.append(Ecu_file(f.name, True))
+        os.remove(f.name)
+        report("ECU files (synthetic)")
+
+    print("Loaded in %.2f s" % (time.time() - start))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--testdb', action="store_true", default=None,
+                        help="Load the database, report its load time and RSS")
+    parser.add_argument('--jsondb', action="store_true", default=None,
+                        help="Load db.json even if a compiled database exists")
+    parser.add_argument('--nosnapshot', action="store_true", default=None,
+                        help="Do not use the database snapshot")
+    parser.add_argument('--benchdb', action="store_true", default=None,
+                        help="Benchmark the db.json and compiled database loading")
+    parser.add_argument('--benchidentify', action="store_true", default=None,
+                        help="Check and benchmark the ECU identification")
+    parser.add_argument('--benchdecode', action="store_true", default=None, help="Check and benchmark data decoding")
+    parser.add_argument('--benchencode', action="store_true", default=None, help="Check and benchmark data encoding")
+    parser.add_argument('--benchmemory', action="store_true", default=None, help="Report memory used by the ECU model")
+
+    args = parser.parse_args()
+
+    if args.testdb:
+        db = test_database(not args.jsondb, not args.nosnapshot)
+
+    if args.benchdb:
+        benchmark_database()
+
+    if args.benchidentify:
+        benchmark_identify()
+
+    if args.benchdecode:
+        benchmark_decode()
+
+    if args.benchencode:
+        benchmark_encode()
+
+    if args.benchmemory:
+        benchmark_memory()
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+'''Benchmarks of the ELM adapter port
+
+Run from the ddt4all directory, e.g. python bench_elm.py --benchport
+'''
+import argparse
+import threading
+import time
+
+import elm
+
+
+def benchmark_port(runs=200):
+    import socket
+
+    # Emulated WiFi adapter answering every command with a 4 KB multi-frame response,
+    # after the ECU latency set in ecu_latency
+    ecu_latency = [0.]
+    frames = ["%X: " % (i % 16) + " ".join("%02X" % ((i * 7 + j) % 256) for j in range(7)) for i in range(200)]
+    response = "\r".join(frames) + "\r\r>"
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def adapter():
+        while True:
+            conn, addr = server.accept()
+            with conn:
+                command = b""
+                while True:
+                    data = conn.recv(64)
+                    if not data:
+                        break
+                    command += data
+                    while b"\r" in command:
+                        line, command = command.split(b"\r", 1)
+                        time.sleep(ecu_latency[0])
+                        conn.sendall(line + b"\r" + response.encode("ascii"))
+
+    threading.Thread(target=adapter, daemon=True).start()
+    portname = "127.0.0.1:%i" % server.getsockname()[1]
+
+    def bytewise_expect(port, pattern, time_out=1):
+        # One byte per call, as the port used to read
+        tb = time.time()
+        buff = ""
+        while True:
+            with port._lock:
+                byte = port.hdr.recv(1)
+            byte = byte.decode("utf-8")
+            if byte == '\r':
+                byte = '\n'
+            buff += byte
+            if pattern in buff:
+                return buff
+            if (time.time() - tb) > time_out:
+                return buff + "TIMEOUT"
+
+    for latency in (0., 0.02):
+        ecu_latency[0] = latency
+        print("ECU latency %i ms" % (latency * 1000))
+        results = {}
+        count = runs if latency == 0 else 25
+        for title, expect in (("Bytewise", bytewise_expect), ("Buffered", elm.Port.expect)):
+            port = elm.Port(portname, 0, "STD")
+            start = time.time()
+            cpu = time.process_time()
+            for i in range(count):
+                port.write(b"22F190\r")
+                results[title] = expect(port, ">", 5)
+            elapsed = time.time() - start
+            cpu = time.process_time() - cpu
+            port.close()
+            print("%s : %7.3f ms per response, %6.1f MB/s, CPU %5.1f %%" % (
+                title, elapsed * 1000. / count, count * len(results[title]) / elapsed / 1048576., cpu * 100. / elapsed))
+        print("Identical responses" if results["Bytewise"] == results["Buffered"] else "Responses differ")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchport', action="store_true", default=None,
+                        help="Benchmark adapter reads against an emulated WiFi adapter")
+
+    args = parser.parse_args()
+
+    if args.benchport:
+        benchmark_port()
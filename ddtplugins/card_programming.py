@@ -108,7 +108,7 @@ class CardProg(gui.QDialog):
         self.setWindowTitle(_("Megane/Scenic II card programming"))
         options.debug = True
         self.apvok = False
-        self.megane_ecu = ecu.Ecu_file(ecufile, True)
+        self.megane_ecu = ecu.get_ecu_file(ecufile)
         self.start_session_request = self.megane_ecu.requests[u'Start Diagnostic Session']
         self.after_sale_request = self.megane_ecu.requests[u'ACCEDER AU MODE APRES-VENTE']
         self.learn_key_request = self.megane_ecu.requests[u'APPRENDRE BADGE']
@@ -35,7 +35,7 @@ def calc_crc(vin=None):
 class Virginizer(gui.QDialog):
     def __init__(self):
         super(Virginizer, self).__init__()
-        self.clio_eps = ecu.Ecu_file(ecufile, True)
+        self.clio_eps = ecu.get_ecu_file(ecufile)
         # Set window icon and title
         appIcon = qtgui.QIcon("ddt4all_data/icons/obd.png")
         self.setWindowIcon(appIcon)
@@ -20,7 +20,7 @@ ecufile = "X98ph2_X87ph2_EPS_HFP_v1.00_20150622T140219_20160726T172209"
 class Virginizer(gui.QDialog):
     def __init__(self):
         super(Virginizer, self).__init__()
-        self.clio_eps = ecu.Ecu_file(ecufile, True)
+        self.clio_eps = ecu.get_ecu_file(ecufile)
         # Set window icon and title
         appIcon = qtgui.QIcon("ddt4all_data/icons/obd.png")
         self.setWindowIcon(appIcon)
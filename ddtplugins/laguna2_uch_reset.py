@@ -21,7 +21,7 @@ ecufile = "UCH___M2S_X74_et_X73"
 class Virginizer(gui.QDialog):
     def __init__(self):
         super(Virginizer, self).__init__()
-        self.laguna_uch = ecu.Ecu_file(ecufile, True)
+        self.laguna_uch = ecu.get_ecu_file(ecufile)
         # Set window icon and title
         appIcon = qtgui.QIcon("ddt4all_data/icons/obd.png")
         self.setWindowIcon(appIcon)
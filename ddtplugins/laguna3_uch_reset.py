@@ -20,7 +20,7 @@ ecufile = "BCM_X91_L43_S_S_SWC_v1.30_20140613T140906"
 class Virginizer(gui.QDialog):
     def __init__(self):
         super(Virginizer, self).__init__()
-        self.megane_uch = ecu.Ecu_file(ecufile, True)
+        self.megane_uch = ecu.get_ecu_file(ecufile)
         # Set window icon and title
         appIcon = qtgui.QIcon("ddt4all_data/icons/obd.png")
         self.setWindowIcon(appIcon)
@@ -20,7 +20,7 @@ need_hw = True
 class Virginizer(gui.QDialog):
     def __init__(self):
         super(Virginizer, self).__init__()
-        self.megane_uch = ecu.Ecu_file("UCH_84_J84_03_60", True)
+        self.megane_uch = ecu.get_ecu_file("UCH_84_J84_03_60")
         # Set window icon and title
         appIcon = qtgui.QIcon("ddt4all_data/icons/obd.png")
         self.setWindowIcon(appIcon)
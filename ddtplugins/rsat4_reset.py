@@ -21,7 +21,7 @@ ecufile = "RSAT4_ACU_eng_v15_20150511T131328"
 class Virginizer(gui.QDialog):
     def __init__(self):
         super(Virginizer, self).__init__()
-        self.airbag_ecu = ecu.Ecu_file(ecufile, True)
+        self.airbag_ecu = ecu.get_ecu_file(ecufile)
         # Set window icon and title
         appIcon = qtgui.QIcon("ddt4all_data/icons/obd.png")
         self.setWindowIcon(appIcon)
@@ -21,7 +21,7 @@ ecufile = "EVC_3180_RH5_510_V1.1_20210422T184714"
 class Virginizer(gui.QDialog):
     def __init__(self):
         super(Virginizer, self).__init__()
-        self.evc_ecu = ecu.Ecu_file(ecufile, True)
+        self.evc_ecu = ecu.get_ecu_file(ecufile)
         self.setWindowTitle(_("Water pump counters"))
         # Set window icon
         appIcon = qtgui.QIcon("ddt4all_data/icons/obd.png")
@@ -2,13 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import os
-import zipfile
+from collections import OrderedDict
 
 import PyQt5.QtCore as core
 import PyQt5.QtWidgets as widgets
 
 from PyQt5.QtGui import QIcon, QPixmap
 
+import ecu
 import options
 from uiutils import *
 
@@ -18,6 +19,46 @@ def unicode(a):
 
 _ = options.translator('ddt4all')
 
+# Graphics read from ecu.zip, least recently used first
+graphics_cache_size = 64
+graphics_cache = OrderedDict()
+
+
+def get_zip_graphic_data(name):
+    '''Returns the content of the gif graphic "name" from ecu.zip, None if not found'''
+    if not ecu.ecu_zip.exists():
+        return None
+    key = ("data", name, ecu.ecu_zip.stamp)
+    if key in graphics_cache:
+        graphics_cache.move_to_end(key)
+        return graphics_cache[key]
+    data = ecu.ecu_zip.read(options.graphics_dir + name + ".gif", True)
+    cache_graphic(key, data)
+    return data
+
+
+def get_zip_pixmap(name):
+    '''Returns the decoded gif graphic "name" from ecu.zip, None if not found'''
+    if not ecu.ecu_zip.exists():
+        return None
+    key = ("pixmap", name, ecu.ecu_zip.stamp)
+    if key in graphics_cache:
+        graphics_cache.move_to_end(key)
+        return graphics_cache[key]
+    pixmap = None
+    data = get_zip_graphic_data(name)
+    if data:
+        pixmap = QPixmap()
+        pixmap.loadFromData(data)
+    cache_graphic(key, pixmap)
+    return pixmap
+
+
+def cache_graphic(key, value):
+    graphics_cache[key] = value
+    while len(graphics_cache) > graphics_cache_size:
+        graphics_cache.popitem(last=False)
+
 
 class labelWidget(widgets.QLabel):
     def __init__(self, parent, uiscale):
@@ -41,17 +82,13 @@ class labelWidget(widgets.QLabel):
         return
 
     def get_zip_graphic(self, name):
-        if os.path.exists("ecu.zip"):
-            zf = zipfile.ZipFile("ecu.zip", "r")
-            zname = "graphics/" + name + ".gif"
-            if not zname in zf.namelist():
-                zname = "graphics/" + name + ".GIF"
-            if zname in zf.namelist():
-                ba = core.QByteArray(zf.read(zname))
-                self.buffer = core.QBuffer()
-                self.buffer.setData(ba)
-                self.buffer.open(core.QIODevice.ReadOnly)
-                self.img = gui.QMovie(self.buffer, b"gif")
+        data = get_zip_graphic_data(name)
+        if data:
+            ba = core.QByteArray(data)
+            self.buffer = core.QBuffer()
+            self.buffer.setData(ba)
+            self.buffer.open(core.QIODevice.ReadOnly)
+            self.img = gui.QMovie(self.buffer, b"gif")
 
     def initXML(self, xmldata):
         text = xmldata.getAttribute("Text")
@@ -316,19 +353,11 @@ class buttonRequest(widgets.QPushButton):
 
         if text.upper().startswith("::BTN:"):
             gifName = text.replace("::BTN:|", "").replace("::btn:|", "").replace("::btn:DOWN|", "").replace("::btn:UP|", "").replace("::btn:LEFT|", "").replace("::btn:RIGHT|", "").replace("\\", "/")
-            if os.path.exists("ecu.zip"):
-                image_data = self.extract_image_from_zip('ecu.zip', os.path.join(options.graphics_dir, gifName + '.gif'))
-                if image_data is None:
-                    image_data = self.extract_image_from_zip('ecu.zip', os.path.join(options.graphics_dir, gifName + '.GIF'))
-                if image_data:
-                    pixmap = QPixmap()
-                    byte_array = core.QByteArray(image_data)
-                    buffer = core.QBuffer(byte_array)
-                    buffer.open(core.QIODevice.ReadOnly)
-                    pixmap.loadFromData(buffer.readAll())
-                    self.setIcon(QIcon(pixmap))
-                    self.setIconSize(self.size())
-                    as_picture = True
+            pixmap = get_zip_pixmap(gifName)
+            if pixmap:
+                self.setIcon(QIcon(pixmap))
+                self.setIconSize(self.size())
+                as_picture = True
         if not as_picture:
             self.setFont(qfnt)
             self.setText(text)
@@ -339,16 +368,6 @@ class buttonRequest(widgets.QPushButton):
         self.uniquename = jsdata['uniquename']
         self.jsondata = jsdata
 
-    @staticmethod
-    def extract_image_from_zip(zip_file, image_name):
-        """Extrait une image du fichier ZIP et retourne les données en mémoire"""
-        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-            if image_name in zip_ref.namelist():
-                # Lire l'image en mémoire et retourner les données
-                return zip_ref.read(image_name)
-            else:
-                return None
-
     def mousePressEvent(self, event):
         if options.simulation_mode and options.mode_edit:
             self.parent().mousePressEvent(event)
@@ -1,13 +1,22 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 import argparse
+import bisect
+import concurrent.futures
 import glob
+import marshal
 import math
+import mmap
 import os
 import re
 import string
+import struct
+import threading
+import time
 import xml.dom.minidom
 import zipfile
+from collections import OrderedDict
+from collections.abc import MutableMapping, Sequence
 from io import BytesIO
 
 import elm
@@ -16,8 +25,6 @@ import options
 
 _ = options.translator('ddt4all')
 
-addressing = {}
-
 
 # Returns signed value from 16 bits (2 bytes)
 def hex16_tosigned(value):
@@ -43,7 +50,176 @@ def getChildNodesByName(parent, name):
     return nodes
 
 
+def is_little_endian(dataitem, ecu_endian):
+    # It seems that DataItem can override Request endianness
+    if dataitem.endian == "Little":
+        return True
+    if dataitem.endian == "Big":
+        return False
+    return ecu_endian == "Little"
+
+
+# Compiled extraction/insertion plans, keyed by (firstbyte, bitoffset, bitscount, little_endian)
+# Only plain values are used as key, the data editor modifies items in place
+# A plan is (startbyte, reqbytelen, databytelen, ((width, shift, mask), ...))
+# False means the layout must be decoded with Ecu_data.getHexValueFromString
+_extraction_plans = {}
+_insertion_plans = {}
+_float_formats = {}
+
+
+def compile_extraction_plan(firstbyte, bitoffset, bitscount, little_endian):
+    if firstbyte < 1 or bitoffset < 0 or bitscount < 1:
+        return False
+
+    databytelen = int(math.ceil(float(bitscount) / 8.0))
+    reqdatabytelen = int(math.ceil(float(bitscount + bitoffset) / 8.0))
+    spanbits = reqdatabytelen * 8
+
+    # Bit slices (first, last) of the requested bytes, same order as the string path
+    slices = []
+    if little_endian:
+        totalremainingbits = bitscount
+        lastbit = 8 - bitoffset
+        firstbit = max(0, lastbit - bitscount)
+        if lastbit < 0:
+            return False
+        slices.append((firstbit, lastbit))
+        totalremainingbits -= lastbit - firstbit
+
+        if totalremainingbits > 8:
+            offset1 = 8
+            offset2 = offset1 + ((reqdatabytelen - 2) * 8)
+            slices.append((offset1, offset2))
+            totalremainingbits -= offset2 - offset1
+
+        if totalremainingbits > 0:
+            offset1 = (reqdatabytelen - 1) * 8
+            offset2 = offset1 - totalremainingbits
+            slices.append((offset2, offset1))
+            totalremainingbits -= offset1 - offset2
+
+        if totalremainingbits != 0:
+            return False
+    else:
+        slices.append((bitoffset, bitoffset + bitscount))
+
+    segments = []
+    for first, last in slices:
+        if first < 0 or last > spanbits or last < first:
+            return False
+        if last == first:
+            continue
+        width = last - first
+        segments.append((width, spanbits - last, (1 << width) - 1))
+
+    return firstbyte - 1, reqdatabytelen, databytelen, tuple(segments)
+
+
+def get_extraction_plan(firstbyte, bitoffset, bitscount, little_endian):
+    key = (firstbyte, bitoffset, bitscount, little_endian)
+    plan = _extraction_plans.get(key)
+    if plan is None:
+        plan = compile_extraction_plan(firstbyte, bitoffset, bitscount, little_endian)
+        _extraction_plans[key] = plan
+    return plan
+
+
+def extract_value(buf, plan):
+    startbyte, reqdatabytelen, databytelen, segments = plan
+    span = int.from_bytes(buf[startbyte:startbyte + reqdatabytelen], 'big')
+    value = 0
+    for width, shift, mask in segments:
+        value = (value << width) | ((span >> shift) & mask)
+    return value
+
+
+def compile_insertion_plan(firstbyte, bitoffset, bitscount, little_endian):
+    if firstbyte < 1 or bitoffset < 0 or bitoffset > 7 or bitscount < 1:
+        return False
+
+    numreqbytes = int(math.ceil(float(bitscount + bitoffset) / 8.0))
+    spanbits = numreqbytes * 8
+
+    # Bit slices (first, last) of the request bytes, same order as the string path
+    slices = []
+    if little_endian:
+        remainingbits = bitscount
+        lastbit = 8 - bitoffset
+        firstbit = max(0, lastbit - bitscount)
+        slices.append((firstbit, lastbit))
+        remainingbits -= lastbit - firstbit
+
+        currentbyte = 1
+        while remainingbits >= 8:
+            slices.append((currentbyte * 8, currentbyte * 8 + 8))
+            remainingbits -= 8
+            currentbyte += 1
+
+        if remainingbits > 0:
+            slices.append((currentbyte * 8 + 8 - remainingbits, currentbyte * 8 + 8))
+    else:
+        slices.append((bitoffset, bitoffset + bitscount))
+
+    # Value bits are consumed from the most significant one
+    segments = []
+    consumed = 0
+    for first, last in slices:
+        if last > spanbits:
+            return False
+        width = last - first
+        consumed += width
+        segments.append((bitscount - consumed, spanbits - last, (1 << width) - 1))
+
+    return firstbyte - 1, numreqbytes, bitscount, tuple(segments)
+
+
+def get_insertion_plan(firstbyte, bitoffset, bitscount, little_endian):
+    key = (firstbyte, bitoffset, bitscount, little_endian)
+    plan = _insertion_plans.get(key)
+    if plan is None:
+        plan = compile_insertion_plan(firstbyte, bitoffset, bitscount, little_endian)
+        _insertion_plans[key] = plan
+    return plan
+
+
+def insert_value(span, value, plan):
+    bitscount = plan[2]
+    # Values wider than the data keep their most significant bits
+    extrabits = value.bit_length() - bitscount
+    if extrabits > 0:
+        value >>= extrabits
+
+    for valueshift, shift, mask in plan[3]:
+        span = (span & ~(mask << shift)) | (((value >> valueshift) & mask) << shift)
+    return span
+
+
+def parse_hex_stream(stream):
+    hexstream = stream.strip().replace(' ', '')
+    try:
+        buf = bytes.fromhex(hexstream)
+    except ValueError:
+        return None
+
+    # bytes.fromhex silently skips other whitespaces, let the string path handle them
+    if len(buf) * 2 != len(hexstream):
+        return None
+    return buf
+
+
+def get_float_format(fmt):
+    if fmt not in _float_formats:
+        if len(fmt) and '.' in fmt:
+            _float_formats[fmt] = '%.' + str(len(fmt.split('.')[1])) + 'f'
+        else:
+            _float_formats[fmt] = None
+    return _float_formats[fmt]
+
+
 class Data_item:
+    __slots__ = ('firstbyte', 'bitoffset', 'ref', 'endian', 'req_endian', 'name')
+
     def __init__(self, item, req_endian, name=''):
         self.firstbyte = 0
         self.bitoffset = 0
@@ -94,6 +270,8 @@ class Data_item:
 
 
 class Ecu_device:
+    __slots__ = ('dtc', 'dtctype', 'devicedata', 'name')
+
     def __init__(self, dev):
         self.dtc = 0
         self.dtctype = 0
@@ -130,7 +308,42 @@ class Ecu_device:
         return js
 
 
+# StartDiagSession requirements flags of Ecu_request
+SDS_FLAGS = {'nosds': 0x01,
+             'plant': 0x02,
+             'aftersales': 0x04,
+             'engineering': 0x08,
+             'supplier': 0x10}
+SDS_ALL = 0x1F
+
+
+class Ecu_sds:
+    '''Dict like view of an Ecu_request SDS bitmask'''
+    __slots__ = ('request',)
+
+    def __init__(self, request):
+        self.request = request
+
+    def __getitem__(self, key):
+        return (self.request.sds_mask & SDS_FLAGS[key]) != 0
+
+    def __setitem__(self, key, value):
+        if value:
+            self.request.sds_mask |= SDS_FLAGS[key]
+        else:
+            self.request.sds_mask &= ~SDS_FLAGS[key]
+
+    def keys(self):
+        return SDS_FLAGS.keys()
+
+    def items(self):
+        return [(k, self[k]) for k in SDS_FLAGS]
+
+
 class Ecu_request:
+    __slots__ = ('minbytes', 'shiftbytescount', 'replybytes', 'manualsend', 'sentbytes', 'dataitems',
+                 'sendbyte_dataitems', 'name', 'ecu_file', 'decoder', 'sds_mask')
+
     def __init__(self, data, ecu_file):
         self.minbytes = 0
         self.shiftbytescount = 0
@@ -141,13 +354,11 @@ class Ecu_request:
         self.sendbyte_dataitems = {}
         self.name = ''
         self.ecu_file = ecu_file
+        # Batch decoder of the received data items, built on first use
+        self.decoder = None
         # StartDiagSession requirements
         # Seems relatively useless...
-        self.sds = {'nosds': True,
-                    'plant': True,
-                    'aftersales': True,
-                    'engineering': True,
-                    'supplier': True}
+        self.sds_mask = SDS_ALL
 
         if isinstance(data, dict):
             if 'minbytes' in data: self.minbytes = data['minbytes']
@@ -158,16 +369,9 @@ class Ecu_request:
 
             self.name = data['name']
             if 'deny_sds' in data:
-                if 'nosds' in data['deny_sds']:
-                    self.sds['nosds'] = False
-                if 'plant' in data['deny_sds']:
-                    self.sds['plant'] = False
-                if 'aftersales' in data['deny_sds']:
-                    self.sds['aftersales'] = False
-                if 'engineering' in data['deny_sds']:
-                    self.sds['engineering'] = False
-                if 'supplier' in data['deny_sds']:
-                    self.sds['supplier'] = False
+                for deny in data['deny_sds']:
+                    if deny in SDS_FLAGS:
+                        self.sds_mask &= ~SDS_FLAGS[deny]
 
             if 'sendbyte_dataitems' in data:
                 sbdi = data['sendbyte_dataitems']
@@ -185,36 +389,36 @@ class Ecu_request:
             # Create a blank, new one
             self.name = data
         else:
-            self.xmldoc = data
-            self.name = self.xmldoc.getAttribute("Name")
+            xmldoc = data
+            self.name = xmldoc.getAttribute("Name")
 
-            accessdata = self.xmldoc.getElementsByTagName("DenyAccess").item(0)
+            accessdata = xmldoc.getElementsByTagName("DenyAccess").item(0)
             if accessdata:
                 for accessdatachild in accessdata.childNodes:
                     if accessdatachild.nodeName == "NoSDS":
-                        self.sds['nosds'] = False
+                        self.sds_mask &= ~SDS_FLAGS['nosds']
                     elif accessdatachild.nodeName == "Plant":
-                        self.sds['plant'] = False
+                        self.sds_mask &= ~SDS_FLAGS['plant']
                     elif accessdatachild.nodeName == "AfterSales":
-                        self.sds['aftersales'] = False
+                        self.sds_mask &= ~SDS_FLAGS['aftersales']
                     elif accessdatachild.nodeName == "Engineering":
-                        self.sds['engineering'] = False
+                        self.sds_mask &= ~SDS_FLAGS['engineering']
                     elif accessdatachild.nodeName == "Supplier":
-                        self.sds['supplier'] = False
+                        self.sds_mask &= ~SDS_FLAGS['supplier']
 
-            manualsenddata = self.xmldoc.getElementsByTagName("ManuelSend").item(0)
+            manualsenddata = xmldoc.getElementsByTagName("ManuelSend").item(0)
             if manualsenddata:
                 self.manualsend = True
 
-            shiftbytescount = self.xmldoc.getElementsByTagName("ShiftBytesCount")
+            shiftbytescount = xmldoc.getElementsByTagName("ShiftBytesCount")
             if shiftbytescount:
                 self.shiftbytescount = int(shiftbytescount.item(0).firstChild.nodeValue)
 
-            replybytes = self.xmldoc.getElementsByTagName("ReplyBytes")
+            replybytes = xmldoc.getElementsByTagName("ReplyBytes")
             if replybytes:
                 self.replybytes = replybytes.item(0).firstChild.nodeValue
 
-            receiveddata = self.xmldoc.getElementsByTagName("Received").item(0)
+            receiveddata = xmldoc.getElementsByTagName("Received").item(0)
             if receiveddata:
                 minbytes = receiveddata.getAttribute("MinBytes")
                 if minbytes:
@@ -226,7 +430,7 @@ class Ecu_request:
                         di = Data_item(dataitem, self.ecu_file.endianness)
                         self.dataitems[di.name] = di
 
-            sentdata = self.xmldoc.getElementsByTagName("Sent")
+            sentdata = xmldoc.getElementsByTagName("Sent")
             if sentdata:
                 sent = sentdata.item(0)
                 sentbytesdata = sent.getElementsByTagName("SentBytes")
@@ -256,21 +460,25 @@ class Ecu_request:
             else:
                 # return default reply bytes...
                 elmstream = self.replybytes
+            response = elm.parse_response(elmstream)
         else:
-            elmstream = options.elm.request(request_stream)
+            response = options.elm.request_bytes(request_stream)
 
         if options.debug:
-            print(_("Received stream "), elmstream)
+            print(_("Received stream "), response.text or response.data.hex(' ').upper())
 
-        if elmstream.startswith('WRONG RESPONSE'):
+        if response.status == elm.Response.FRAMING and response.text.startswith('WRONG RESPONSE'):
             return None
 
-        if elmstream.startswith('7F'):
-            nrsp = options.elm.errorval(elmstream[6:8])
-            print(_("Request ECU Error"), nrsp)
+        if response.status == elm.Response.NEGATIVE:
+            print(_("Request ECU Error"), response.nrc_text())
             return None
 
-        values = self.get_values_from_stream(elmstream)
+        if response.status == elm.Response.FRAMING:
+            # Let the string decoder deal with it, as before
+            values = self.get_values_from_stream(response.text)
+        else:
+            values = self.get_values_from_stream(response.data)
 
         if options.debug:
             print(_("Decoded values"), values)
@@ -281,8 +489,30 @@ class Ecu_request:
         return self.sendbyte_dataitems.keys()
 
     def build_data_stream(self, data):
+        data_bytes = self.build_data_bytes(data)
+        if data_bytes is not None:
+            return ['%02X' % b for b in data_bytes]
+
+        # Sent bytes are not plain hex, work on the string list
         data_stream = self.get_formatted_sentbytes()
+        for datatitem, ecudata, v in self.get_data_inputs_values(data):
+            ecudata.setValue(v, data_stream, datatitem, self.ecu_file.endianness)
+
+        return data_stream
+
+    def build_data_bytes(self, data):
+        data_bytes = parse_hex_stream(self.sentbytes)
+        if data_bytes is None:
+            return None
 
+        data_bytes = bytearray(data_bytes)
+        for datatitem, ecudata, v in self.get_data_inputs_values(data):
+            ecudata.setValueBytes(v, data_bytes, datatitem, self.ecu_file.endianness)
+
+        return bytes(data_bytes)
+
+    def get_data_inputs_values(self, data):
+        inputs = []
         for k, v in data.items():
             if k in self.sendbyte_dataitems:
                 datatitem = self.sendbyte_dataitems[k]
@@ -290,26 +520,28 @@ class Ecu_request:
                 raise KeyError('Ecurequest::build_data_stream : Data item %s does not exist' % k)
 
             if k in self.ecu_file.data:
-                data = self.ecu_file.data[k]
+                ecudata = self.ecu_file.data[k]
             else:
                 raise KeyError('Ecurequest::build_data_stream : Data %s does not exist' % k)
 
-            if v in data.items:
-                v = hex(data.items[v])[2:].upper()
+            if v in ecudata.items:
+                v = hex(ecudata.items[v])[2:].upper()
 
-            data.setValue(v, data_stream, datatitem, self.ecu_file.endianness)
+            inputs.append((datatitem, ecudata, v))
+        return inputs
 
-        return data_stream
+    @property
+    def sds(self):
+        return Ecu_sds(self)
 
-    def get_values_from_stream(self, stream):
-        values = {}
-        for k, v in self.dataitems.items():
-            if k in self.ecu_file.data:
-                data = self.ecu_file.data[k]
-                values[k] = data.getDisplayValue(stream, v, self.ecu_file.endianness)
-            else:
-                raise KeyError('Ecurequest::get_values_from_stream : Data %s does not exist' % k)
-        return values
+    def get_decoder(self):
+        # Data items can be added, removed or renamed by the data editor
+        if self.decoder is None or not self.decoder.is_valid(self):
+            self.decoder = Ecu_request_decoder(self)
+        return self.decoder
+
+    def get_values_from_stream(self, stream, names=None):
+        return self.get_decoder().decode(stream, names)
 
     def get_formatted_sentbytes(self):
         bytes_to_send_ascii = self.sentbytes
@@ -329,17 +561,7 @@ class Ecu_request:
             js['sentbytes'] = self.sentbytes
 
         js['name'] = self.name
-        js['deny_sds'] = []
-        if self.sds['nosds'] is False:
-            js['deny_sds'].append('nosds')
-        if self.sds['plant'] is False:
-            js['deny_sds'].append('plant')
-        if self.sds['aftersales'] is False:
-            js['deny_sds'].append('aftersales')
-        if self.sds['engineering'] is False:
-            js['deny_sds'].append('engineering')
-        if self.sds['supplier'] is False:
-            js['deny_sds'].append('supplier')
+        js['deny_sds'] = [k for k, v in SDS_FLAGS.items() if not self.sds_mask & v]
 
         sdi = {}
         for key, value in self.sendbyte_dataitems.items():
@@ -367,7 +589,14 @@ class Ecu_request:
         return di
 
 
+# Shared by the Ecu_data without lists, always replaced, never modified
+_empty_dict = {}
+
+
 class Ecu_data:
+    __slots__ = ('bitscount', 'scaled', 'signed', 'byte', 'binary', 'bytescount', 'bytesascii', 'step', 'offset',
+                 'divideby', 'format', 'lists', 'items', 'description', 'unit', 'comment', 'name')
+
     def __init__(self, data, name=''):
         self.bitscount = 8
         self.scaled = False
@@ -380,8 +609,8 @@ class Ecu_data:
         self.offset = 0.0
         self.divideby = 1.0
         self.format = ""
-        self.lists = {}
-        self.items = {}
+        self.lists = _empty_dict
+        self.items = _empty_dict
         self.description = ''
         self.unit = ""
         self.comment = ''
@@ -421,22 +650,26 @@ class Ecu_data:
                 self.comment = data['comment']
 
             if 'lists' in data:
+                self.lists = {}
+                self.items = {}
                 for k, v in data['lists'].items():
                     self.lists[int(k)] = v
                     self.items[v] = int(k)
         else:
-            self.xmldoc = data
-            self.name = self.xmldoc.getAttribute("Name")
-            description = self.xmldoc.getElementsByTagName("Description")
+            xmldoc = data
+            self.name = xmldoc.getAttribute("Name")
+            description = xmldoc.getElementsByTagName("Description")
             if description:
                 self.description = description.item(0).firstChild.nodeValue.replace('<![CDATA[', '').replace(']]>', '')
 
-            comment = self.xmldoc.getElementsByTagName("Comment")
+            comment = xmldoc.getElementsByTagName("Comment")
             if comment:
                 self.comment = comment.item(0).firstChild.nodeValue.replace('<![CDATA[', '').replace(']]>', '')
 
-            lst = self.xmldoc.getElementsByTagName("List")
+            lst = xmldoc.getElementsByTagName("List")
             if lst:
+                self.lists = {}
+                self.items = {}
                 for l in lst:
                     items = l.getElementsByTagName("Item")
                     for item in items:
@@ -445,7 +678,7 @@ class Ecu_data:
                         self.lists[int(key)] = val
                         self.items[val] = int(key)
 
-            bytes = self.xmldoc.getElementsByTagName("Bytes")
+            bytes = xmldoc.getElementsByTagName("Bytes")
             if bytes:
                 self.byte = True
                 bytescount = bytes.item(0).getAttribute("count").replace(',', '.')
@@ -459,7 +692,7 @@ class Ecu_data:
                 bytesascii = bytes.item(0).getAttribute("ascii")
                 if bytesascii and bytesascii == '1': self.bytesascii = True
 
-            bits = self.xmldoc.getElementsByTagName("Bits")
+            bits = xmldoc.getElementsByTagName("Bits")
             if bits:
                 bitscount = bits.item(0).getAttribute("count")
                 if bitscount:
@@ -535,20 +768,53 @@ class Ecu_data:
         return self.name, js
 
     def setValue(self, value, bytes_list, dataitem, ecu_endian, test_mode=False):
-        start_byte = dataitem.firstbyte - 1
-        start_bit = dataitem.bitoffset
-        little_endian = False
+        value = self.encodeValue(value, test_mode)
+        if value is None:
+            return None
+
+        little_endian = is_little_endian(dataitem, ecu_endian)
+        plan = get_insertion_plan(dataitem.firstbyte, dataitem.bitoffset, self.bitscount, little_endian)
+
+        if plan and value >= 0:
+            start_byte, numreqbytes = plan[0], plan[1]
+            hexspan = "".join(bytes_list[start_byte:start_byte + numreqbytes])
+            if len(hexspan) == numreqbytes * 2:
+                try:
+                    span = bytes.fromhex(hexspan)
+                except ValueError:
+                    span = None
+                if span is not None:
+                    span = insert_value(int.from_bytes(span, 'big'), value, plan)
+                    valueashex = '%0*X' % (numreqbytes * 2, span)
+                    for i in range(numreqbytes):
+                        bytes_list[i + start_byte] = valueashex[i * 2:i * 2 + 2]
+                    return bytes_list
+
+        return self.setValueToString(value, bytes_list, dataitem, little_endian)
+
+    def setValueBytes(self, value, data_bytes, dataitem, ecu_endian, test_mode=False):
+        # Same as setValue, working in place on a bytearray
+        value = self.encodeValue(value, test_mode)
+        if value is None:
+            return None
 
-        if ecu_endian == "Little":
-            little_endian = True
+        little_endian = is_little_endian(dataitem, ecu_endian)
+        plan = get_insertion_plan(dataitem.firstbyte, dataitem.bitoffset, self.bitscount, little_endian)
 
-        # It seems that DataItem can override Request endianness
-        if dataitem.endian == "Little":
-            little_endian = True
+        if plan and value >= 0 and len(data_bytes) >= plan[0] + plan[1]:
+            start_byte, numreqbytes = plan[0], plan[1]
+            span = int.from_bytes(data_bytes[start_byte:start_byte + numreqbytes], 'big')
+            span = insert_value(span, value, plan)
+            data_bytes[start_byte:start_byte + numreqbytes] = span.to_bytes(numreqbytes, 'big')
+            return data_bytes
 
-        if dataitem.endian == "Big":
-            little_endian = False
+        bytes_list = ['%02X' % b for b in data_bytes]
+        self.setValueToString(value, bytes_list, dataitem, little_endian)
+        data_bytes[:] = bytes.fromhex("".join(bytes_list))
+        return data_bytes
 
+    def encodeValue(self, value, test_mode=False):
+        # Returns the raw integer value to write, None if the input is invalid
         if self.bytesascii:
             value = str(value)
             if self.bytescount > len(value):
@@ -586,6 +852,14 @@ class Ecu_data:
             else:
                 value = int("0x" + value, 16)
 
+        return value
+
+    def setValueToString(self, value, bytes_list, dataitem, little_endian):
+        # Reference implementation working on a binary string,
+        # used for the layouts the compiled plans don't handle
+        start_byte = dataitem.firstbyte - 1
+        start_bit = dataitem.bitoffset
+
         valueasbin = bin(value)[2:].zfill(self.bitscount)
 
         numreqbytes = int(math.ceil(float(self.bitscount + start_bit) / 8.))
@@ -650,34 +924,35 @@ class Ecu_data:
         return bytes_list
 
     def getDisplayValue(self, elm_data, dataitem, ecu_endian):
-        value = self.getHexValue(elm_data, dataitem, ecu_endian)
+        value = self.getRawValue(elm_data, dataitem, ecu_endian)
         if value is None:
             return None
 
+        return self.formatValue(value, dataitem)
+
+    def formatValue(self, value, dataitem):
         if self.bytesascii:
-            return bytes.fromhex(value).decode('utf-8', errors="ignore")
+            return bytes.fromhex(self.formatHexValue(value)).decode('utf-8', errors="ignore")
 
         # I think we want Hex format for non scaled values
         if not self.scaled:
-            val = int('0x' + value, 16)
+            hexval = self.formatHexValue(value)
 
             # Manage signed values
             if self.signed:
                 if self.bytescount == 1:
-                    val = hex8_tosigned(val)
+                    value = hex8_tosigned(value)
                 elif self.bytescount == 2:
-                    val = hex16_tosigned(val)
+                    value = hex16_tosigned(value)
                 else:
                     print(_("Warning, cannot get signed value for") + " %s" % dataitem.name)
 
             # Manage mapped values if exists
-            if val in self.lists:
-                return self.lists[val]
+            if value in self.lists:
+                return self.lists[value]
 
             # Return default hex value
-            return value
-
-        value = int('0x' + value, 16)
+            return hexval
 
         # Manage signed values
         if self.signed:
@@ -692,34 +967,60 @@ class Ecu_data:
 
         res = (float(value) * float(self.step) + float(self.offset)) / float(self.divideby)
 
-        if len(self.format) and '.' in self.format:
-            acc = len(self.format.split('.')[1])
-            fmt = '%.' + str(acc) + 'f'
-            res = fmt % res
-        else:
-            if int(res) == res:
-                return str(int(res))
+        fmt = get_float_format(self.format)
+        if fmt is not None:
+            return fmt % res
+
+        if int(res) == res:
+            return str(int(res))
 
         return str(res)
 
     def getIntValue(self, resp, dataitem, ecu_endian):
-        val = self.getHexValue(resp, dataitem, ecu_endian)
-        if val is None:
-            return None
-
-        return int("0x" + val, 16)
+        return self.getRawValue(resp, dataitem, ecu_endian)
 
     def getHexValue(self, resp, dataitem, ecu_endian):
-        little_endian = False
+        value = self.getRawValue(resp, dataitem, ecu_endian)
+        if value is None:
+            return None
 
-        if ecu_endian == "Little":
-            little_endian = True
+        return self.formatHexValue(value)
 
-        if dataitem.endian == "Little":
-            little_endian = True
+    def formatHexValue(self, value):
+        # Resize to original length
+        return '%0*x' % (int(math.ceil(float(self.bitscount) / 8.0)) * 2, value)
+
+    def getRawValue(self, resp, dataitem, ecu_endian):
+        # resp is either the hex string or the response bytes
+        if isinstance(resp, str):
+            return self.getRawValueFromBytes(parse_hex_stream(resp), dataitem, ecu_endian, resp)
+        return self.getRawValueFromBytes(bytes(resp), dataitem, ecu_endian)
+
+    def getRawValueFromBytes(self, buf, dataitem, ecu_endian, resp=None):
+        # buf is the parsed response (None if it couldn't be parsed)
+        # resp is the original string, only needed by the fallback path
+        little_endian = is_little_endian(dataitem, ecu_endian)
+        plan = get_extraction_plan(dataitem.firstbyte, dataitem.bitoffset, self.bitscount, little_endian)
+
+        if plan and buf is not None:
+            if len(buf) >= plan[0] + plan[1]:
+                return extract_value(buf, plan)
+            if len(buf) < plan[0] + plan[2]:
+                return None
+
+        if resp is None:
+            resp = buf.hex() if buf is not None else ''
+
+        hexval = self.getHexValueFromString(resp, dataitem, ecu_endian)
+        if hexval is None:
+            return None
 
-        if dataitem.endian == "Big":
-            little_endian = False
+        return int(hexval, 16)
+
+    def getHexValueFromString(self, resp, dataitem, ecu_endian):
+        # Reference implementation working on a binary string,
+        # used for the layouts the compiled plans don't handle
+        little_endian = is_little_endian(dataitem, ecu_endian)
 
         # Data cleaning
         resp = resp.strip().replace(' ', '')
@@ -785,8 +1086,262 @@ class Ecu_data:
         return hexval
 
 
+class Ecu_request_decoder:
+    def __init__(self, request):
+        self.endianness = request.ecu_file.endianness
+        self.dataitems = tuple(request.dataitems.items())
+        self.entries = {}
+        for k, v in self.dataitems:
+            if k in request.ecu_file.data:
+                self.entries[k] = (v, request.ecu_file.data[k])
+            else:
+                raise KeyError('Ecurequest::get_values_from_stream : Data %s does not exist' % k)
+
+    def is_valid(self, request):
+        # The data editor can also replace the Ecu_data objects of the file
+        data = request.ecu_file.data
+        return self.endianness == request.ecu_file.endianness and \
+            self.dataitems == tuple(request.dataitems.items()) and \
+            all(data.get(k) is entry[1] for k, entry in self.entries.items())
+
+    def decode(self, stream, names=None):
+        # Parse the response once, then decode all (or only the given) data items
+        if isinstance(stream, str):
+            buf = parse_hex_stream(stream)
+        else:
+            buf = bytes(stream)
+            stream = None
+        if names is None:
+            names = self.entries.keys()
+
+        values = {}
+        for k in names:
+            dataitem, data = self.entries[k]
+            value = data.getRawValueFromBytes(buf, dataitem, self.endianness, stream)
+            if value is not None:
+                value = data.formatValue(value, dataitem)
+            values[k] = value
+        return values
+
+
+class Ecu_zip:
+    '''Shared read access to the ecu.zip database
+       The archive is opened once and reopened when the file changes
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.zf = None
+        self.stamp = None
+        self.names = {}
+        # The database may be loaded from another thread
+        self.lock = threading.RLock()
+
+    def check(self):
+        # Returns True if the archive is available, (re)opens it if needed
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            stat = None
+
+        with self.lock:
+            if stat is None:
+                self.close()
+                return False
+
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if stamp != self.stamp:
+                self.close()
+                try:
+                    self.zf = zipfile.ZipFile(self.filename, mode='r')
+                except (OSError, zipfile.BadZipFile) as e:
+                    print(_("Cannot open ") + self.filename, e)
+                    return False
+                self.stamp = stamp
+                # Case insensitive index, exact names are looked up first
+                for name in reversed(self.zf.namelist()):
+                    self.names[name.lower()] = name
+            return True
+
+    def close(self):
+        if self.zf is not None:
+            self.zf.close()
+        self.zf = None
+        self.stamp = None
+        self.names = {}
+
+    def exists(self):
+        return self.check()
+
+    def find(self, name, nocase=False):
+        # Returns the archive name of an entry, None if not found
+        if not self.check():
+            return None
+        try:
+            self.zf.getinfo(name)
+            return name
+        except KeyError:
+            pass
+        if nocase:
+            return self.names.get(name.lower())
+        return None
+
+    def getinfo(self, name):
+        if not self.check():
+            return None
+        return self.zf.getinfo(name)
+
+    def read(self, name, nocase=False):
+        # Returns the content of an entry as bytes, None if not found
+        with self.lock:
+            name = self.find(name, nocase)
+            if name is None:
+                return None
+            return self.zf.read(name)
+
+
+ecu_zip = Ecu_zip("ecu.zip")
+
+
+def locate_ecu_file(data):
+    '''Resolves an ECU file name
+       Returns (name, path of the file or None, ecu.zip entry or None)
+    '''
+    if not os.path.exists(data):
+        if os.path.exists("./ecus/" + data + ".xml"):
+            data = "./ecus/" + data + ".xml"
+
+    if ".xml" not in data[-4:] and ".json" not in data[-5:]:
+        xmlname = data + ".xml"
+        if os.path.exists(xmlname):
+            data = xmlname
+        else:
+            data += ".json"
+
+    if '.json' not in data:
+        if os.path.exists(data):
+            return data, data, None
+        return data, None, None
+
+    data2 = "./json/" + os.path.basename(data)
+    if os.path.exists(data):
+        return data, data, None
+    if os.path.exists(data2):
+        return data, data2, None
+    if ecu_zip.find(data):
+        return data, None, data
+    if ecu_zip.find(os.path.basename(data)):
+        return data, None, os.path.basename(data)
+    return data, None, None
+
+
+# Parsed ECU files shared by the screens, the sniffer and the plugins
+# source -> (stamp, Ecu_file), least recently used first
+ecu_file_cache_size = 8
+ecu_file_cache = OrderedDict()
+ecu_file_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def get_ecu_file_source(path, zipentry):
+    # Returns the cache key of a file and its current version stamp
+    if zipentry:
+        info = ecu_zip.getinfo(zipentry)
+        return (os.path.abspath(ecu_zip.filename), zipentry), (info.CRC, info.file_size, ecu_zip.stamp)
+    stat = os.stat(path)
+    return (os.path.abspath(path), None), (stat.st_mtime_ns, stat.st_size)
+
+
+def get_ecu_file(data):
+    '''Returns the shared Ecu_file of an ECU file name, parsing it if needed
+       The same object is returned to all callers until the file changes,
+       it must not be modified, editors load their own Ecu_file
+    '''
+    name, path, zipentry = locate_ecu_file(data)
+    if path is None and zipentry is None:
+        # Let Ecu_file report the error
+        return Ecu_file(data, True)
+
+    source, stamp = get_ecu_file_source(path, zipentry)
+    entry = ecu_file_cache.get(source)
+    if entry is not None and entry[0] == stamp:
+        ecu_file_cache_stats['hits'] += 1
+        ecu_file_cache.move_to_end(source)
+        ecu_file = entry[1]
+    else:
+        ecu_file_cache_stats['misses'] += 1
+        ecu_file = Ecu_file(data, True)
+        ecu_file_cache[source] = (stamp, ecu_file)
+        ecu_file_cache.move_to_end(source)
+        while len(ecu_file_cache) > ecu_file_cache_size:
+            ecu_file_cache.popitem(last=False)
+
+    if options.debug:
+        print(_("ECU file cache"), ecu_file_cache_stats)
+    return ecu_file
+
+
+def invalidate_ecu_file(data=None):
+    '''Drops an ECU file (name or Ecu_file object) from the shared cache, all files if None'''
+    if data is None:
+        ecu_file_cache.clear()
+        return
+
+    if isinstance(data, Ecu_file):
+        sources = [k for k, v in ecu_file_cache.items() if v[1] is data]
+    else:
+        name, path, zipentry = locate_ecu_file(data)
+        if path:
+            sources = [(os.path.abspath(path), None)]
+        else:
+            sources = [(os.path.abspath(ecu_zip.filename), zipentry)]
+
+    for source in sources:
+        ecu_file_cache.pop(source, None)
+
+
+class Ecu_lazy_dict(MutableMapping):
+    '''Mapping building its values from the raw JSON data on first access'''
+
+    def __init__(self, raw, factory):
+        self.store = dict(raw)
+        self.pending = set(self.store)
+        self.factory = factory
+
+    def __getitem__(self, key):
+        value = self.store[key]
+        if key in self.pending:
+            value = self.factory(key, value)
+            self.store[key] = value
+            self.pending.discard(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store[key] = value
+        self.pending.discard(key)
+
+    def __delitem__(self, key):
+        del self.store[key]
+        self.pending.discard(key)
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def __iter__(self):
+        return iter(self.store)
+
+    def __len__(self):
+        return len(self.store)
+
+    def keys(self):
+        return self.store.keys()
+
+    def materialize(self):
+        for key in list(self.pending):
+            self[key]
+
+
 class Ecu_file:
-    def __init__(self, data, isfile=False):
+    def __init__(self, data, isfile=False, lazy=True):
         self.requests = {}
         self.devices = {}
         self.data = {}
@@ -808,39 +1363,20 @@ class Ecu_file:
             return
 
         if isfile:
-            if not os.path.exists(data):
-                if os.path.exists("./ecus/" + data + ".xml"):
-                    data = "./ecus/" + data + ".xml"
-
-        if isfile and ".xml" not in data[-4:] and ".json" not in data[-5:]:
-            xmlname = data + ".xml"
-            if os.path.exists(xmlname):
-                data = xmlname
-            else:
-                data += ".json"
+            data, path, zipentry = locate_ecu_file(data)
 
         if isfile and '.json' in data:
-            data2 = "./json/" + os.path.basename(data)
             jsdata = None
-            if os.path.exists(data):
-                jsfile = open(data, "r")
-                jsdata = jsfile.read()
-                jsfile.close()
-            elif os.path.exists(data2):
-                jsfile = open(data2, "r")
+            if path:
+                jsfile = open(path, "r")
                 jsdata = jsfile.read()
                 jsfile.close()
-            else:
+            elif zipentry:
                 # Zipped json here
-                if os.path.exists('ecu.zip'):
-                    zf = zipfile.ZipFile('ecu.zip', mode='r')
-                    if data in zf.namelist():
-                        jsdata = zf.read(data)
-                    elif os.path.basename(data) in zf.namelist():
-                        jsdata = zf.read(os.path.basename(data))
-                    else:
-                        print(_("Cannot find file "), data)
-                        return
+                jsdata = ecu_zip.read(zipentry)
+            elif ecu_zip.exists():
+                print(_("Cannot find file "), data)
+                return
 
             if jsdata is None:
                 return
@@ -875,13 +1411,19 @@ class Ecu_file:
                 self.devices[ecu_dev.name] = ecu_dev
 
             requests = ecudict['requests']
-            for request in requests:
-                ecu_req = Ecu_request(request, self)
-                self.requests[ecu_req.name] = ecu_req
-
             datalist = ecudict['data']
-            for k, v in datalist.items():
-                self.data[k] = Ecu_data(v, k)
+            if lazy:
+                # Only build what the screens and plugins use
+                self.requests = Ecu_lazy_dict(((r['name'], r) for r in requests),
+                                              lambda k, v: Ecu_request(v, self))
+                self.data = Ecu_lazy_dict(datalist, lambda k, v: Ecu_data(v, k))
+            else:
+                for request in requests:
+                    ecu_req = Ecu_request(request, self)
+                    self.requests[ecu_req.name] = ecu_req
+
+                for k, v in datalist.items():
+                    self.data[k] = Ecu_data(v, k)
         else:
             if isfile:
                 if not os.path.exists(data):
@@ -1000,6 +1542,21 @@ class Ecu_file:
                 return v
         return None
 
+    def get_calibration_reads(self):
+        '''Read requests of the DIDs and local ids this ECU has a write request for'''
+        reads = set()
+        for name in self.requests.keys():
+            if isinstance(self.requests, Ecu_lazy_dict) and name in self.requests.pending:
+                sentbytes = self.requests.store[name].get('sentbytes', '')
+            else:
+                sentbytes = self.requests[name].sentbytes
+            sentbytes = sentbytes.replace(' ', '').upper()
+            if sentbytes[:2] in elm.write_services:
+                read_service, length = elm.write_services[sentbytes[:2]]
+                if len(sentbytes) >= 2 + length:
+                    reads.add(read_service + sentbytes[2:2 + length])
+        return reads
+
     def connect_to_hardware(self, canline=0):
         # Can
         ecuname = self.ecuname.encode('ascii', errors='ignore')
@@ -1058,7 +1615,15 @@ class Ecu_file:
 
         return idents
 
+    def materialize(self):
+        # Build all the lazily loaded requests and data
+        if isinstance(self.requests, Ecu_lazy_dict):
+            self.requests.materialize()
+        if isinstance(self.data, Ecu_lazy_dict):
+            self.data.materialize()
+
     def dumpJson(self):
+        self.materialize()
         js = {}
         js['autoidents'] = self.autoidents
         js['ecuname'] = self.ecuname
@@ -1108,6 +1673,9 @@ class Ecu_file:
 # ISO8                                  ?ATSP 3?
 
 class Ecu_ident:
+    __slots__ = ('diagversion', 'supplier', 'soft', 'version', 'name', 'group', 'projects', 'href', 'addr',
+                 'db_addr', 'protocol', 'hash', 'zipped')
+
     def __init__(self, diagversion, supplier, soft, version, name, group, href, protocol, projects, address,
                  zipped=False):
         self.diagversion = diagversion
@@ -1119,6 +1687,8 @@ class Ecu_ident:
         self.projects = projects
         self.href = href
         self.addr = address
+        # addr becomes the address the ECU answered on when scanned, db_addr stays
+        self.db_addr = address
         if "CAN" in protocol.upper():
             self.protocol = 'CAN'
         elif "KWP" in protocol.upper():
@@ -1173,25 +1743,559 @@ class Ecu_ident:
         return js
 
 
+# Compiled form of the ecu.zip vehicles database, written by compile_database()
+# All integers are little endian uint32, strings are sorted and referenced by index
+# Header : magic, version, db.json CRC and size, number of ECU files,
+#          then (offset, count) of the strings, targets, addresses, projects, names, hrefs and pool sections,
+#          and (pool index, count) of the KWP and CAN addresses lists
+# Pool   : uint32 lists referenced by the records below
+compiled_db_file = "ecudb.bin"
+compiled_db_magic = b"DDTECUDB"
+compiled_db_version = 1
+compiled_db_header = struct.Struct("<8sIIII" + "II" * 9)
+# diagversion, supplier, soft, version, name, group, href, protocol, address, projects pool index and count
+compiled_db_target = struct.Struct("<11I")
+# address, group, targets pool index and count
+compiled_db_address = struct.Struct("<4I")
+# key, pool index and count, used by the projects (protocol/address pairs), names and hrefs (targets) sections
+compiled_db_posting = struct.Struct("<3I")
+
+
+class Ecu_database_file:
+    '''Memory mapped compiled vehicles database
+       Ecu_ident objects are only built when asked for
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.strings = {}
+        self.address_index = None
+        with open(filename, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = compiled_db_header.unpack_from(self.mm, 0)
+        if header[0] != compiled_db_magic or header[1] != compiled_db_version:
+            self.close()
+            raise ValueError("Not a compiled database, or wrong version")
+        self.crc, self.size, self.numecu = header[2:5]
+        sections = header[5:]
+        self.strings_offset, self.numstrings = sections[0:2]
+        self.targets_offset, self.numtargets = sections[2:4]
+        self.addresses_offset, self.numaddresses = sections[4:6]
+        self.projects_offset, self.numprojects = sections[6:8]
+        self.names_offset, self.numnames = sections[8:10]
+        self.hrefs_offset, self.numhrefs = sections[10:12]
+        self.pool_offset = sections[12]
+        self.kwp_list = sections[14:16]
+        self.can_list = sections[16:18]
+        self.blob_offset = self.strings_offset + 4 * (self.numstrings + 1)
+
+    def close(self):
+        self.mm.close()
+
+    def __len__(self):
+        return self.numtargets
+
+    def string(self, index):
+        s = self.strings.get(index)
+        if s is None:
+            start, end = struct.unpack_from("<2I", self.mm, self.strings_offset + 4 * index)
+            s = self.mm[self.blob_offset + start:self.blob_offset + end].decode("utf-8")
+            self.strings[index] = s
+        return s
+
+    def string_index(self, s):
+        # Strings are sorted by their utf-8 form, returns None if not found
+        key = s.encode("utf-8")
+        lo, hi = 0, self.numstrings
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, end = struct.unpack_from("<2I", self.mm, self.strings_offset + 4 * mid)
+            value = self.mm[self.blob_offset + start:self.blob_offset + end]
+            if value < key:
+                lo = mid + 1
+            elif value > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def pool(self, index, count):
+        return struct.unpack_from("<%iI" % count, self.mm, self.pool_offset + 4 * index)
+
+    def target(self, index):
+        record = compiled_db_target.unpack_from(self.mm, self.targets_offset + compiled_db_target.size * index)
+        s = self.string
+        projects = [s(i) for i in self.pool(record[9], record[10])]
+        return Ecu_ident(s(record[0]), s(record[1]), s(record[2]), s(record[3]), s(record[4]), s(record[5]),
+                         s(record[6]), s(record[7]), projects, s(record[8]), True)
+
+    def addresses(self):
+        # Yields (address, group, targets indexes) in database order
+        for i in range(self.numaddresses):
+            addr, group, index, count = compiled_db_address.unpack_from(
+                self.mm, self.addresses_offset + compiled_db_address.size * i)
+            yield self.string(addr), self.string(group), self.pool(index, count)
+
+    def projects(self):
+        # Yields (project, [(protocol, address), ...]) in database order
+        for i in range(self.numprojects):
+            proj, index, count = compiled_db_posting.unpack_from(
+                self.mm, self.projects_offset + compiled_db_posting.size * i)
+            pairs = self.pool(index, 2 * count)
+            yield self.string(proj), [(self.string(pairs[j]), self.string(pairs[j + 1]))
+                                      for j in range(0, len(pairs), 2)]
+
+    def kwp_addresses(self):
+        return [self.string(i) for i in self.pool(*self.kwp_list)]
+
+    def can_addresses(self):
+        return [self.string(i) for i in self.pool(*self.can_list)]
+
+    def postings(self, attribute):
+        # Returns the offset and count of the name or href postings
+        if attribute == "name":
+            return self.names_offset, self.numnames
+        return self.hrefs_offset, self.numhrefs
+
+    def values(self, attribute):
+        # Returns the values of the targets name, href or address
+        if attribute == "db_addr":
+            return [addr for addr, group, targets in self.addresses()]
+        offset, count = self.postings(attribute)
+        return [self.string(compiled_db_posting.unpack_from(self.mm, offset + compiled_db_posting.size * i)[0])
+                for i in range(count)]
+
+    def lookup(self, attribute, value):
+        # Returns the indexes of the targets whose name, href or address is value
+        if attribute == "db_addr":
+            if self.address_index is None:
+                self.address_index = {addr: targets for addr, group, targets in self.addresses()}
+            return self.address_index.get(value, ())
+        offset, count = self.postings(attribute)
+        key = self.string_index(value)
+        if key is None:
+            return ()
+        # Postings are sorted by key
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, index, num = compiled_db_posting.unpack_from(self.mm, offset + compiled_db_posting.size * mid)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return self.pool(index, num)
+        return ()
+
+
+class Ecu_target_list(Sequence):
+    '''List of Ecu_ident, the compiled database and snapshot ones are built on first access
+       Targets are indexed by name, href and database address
+    '''
+    indexed = ("name", "href", "db_addr")
+
+    def __init__(self):
+        self.items = []
+        self.dbfile = None
+        self.first = 0
+        # attribute -> value -> positions in self.items, compiled targets excepted
+        self.indexes = {attribute: {} for attribute in self.indexed}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.items)
+        target = self.items[index]
+        if target is None:
+            target = self.dbfile.target(index - self.first)
+            self.items[index] = target
+        elif type(target) is tuple:
+            # Row from the startup snapshot
+            target = Ecu_ident(*target)
+            self.items[index] = target
+        return target
+
+    def __iter__(self):
+        for i in range(len(self.items)):
+            yield self[i]
+
+    def append(self, target):
+        position = len(self.items)
+        self.items.append(target)
+        for attribute, index in self.indexes.items():
+            value = getattr(target, attribute)
+            if value in index:
+                index[value].append(position)
+            else:
+                index[value] = [position]
+
+    def get_state(self):
+        # Plain data form of the list, compiled targets are only referenced
+        rows = [(t.diagversion, t.supplier, t.soft, t.version, t.name, t.group, t.href, t.protocol, t.projects,
+                 t.db_addr, t.zipped) if isinstance(t, Ecu_ident) else t for t in self.items]
+        compiled = None
+        if self.dbfile is not None:
+            rows[self.first:self.first + len(self.dbfile)] = [None] * len(self.dbfile)
+            compiled = (self.dbfile.filename, self.first)
+        return {"rows": rows, "compiled": compiled, "indexes": self.indexes}
+
+    def set_state(self, state):
+        # Targets are built on first access
+        self.items = state["rows"]
+        self.indexes = state["indexes"]
+        if state["compiled"] is not None:
+            filename, self.first = state["compiled"]
+            self.dbfile = Ecu_database_file(filename)
+
+    def extend_compiled(self, dbfile):
+        self.dbfile = dbfile
+        self.first = len(self.items)
+        self.items.extend([None] * len(dbfile))
+
+    def positions(self, attribute, value):
+        # Returns the positions of the targets whose indexed attribute equals value, in list order
+        positions = self.indexes[attribute].get(value, [])
+        if self.dbfile is not None:
+            compiled = [self.first + i for i in self.dbfile.lookup(attribute, value)]
+            if compiled:
+                positions = sorted(positions + compiled)
+        return positions
+
+    def values(self, attribute):
+        # Returns the values of an indexed attribute
+        values = set(self.indexes[attribute])
+        if self.dbfile is not None:
+            values.update(self.dbfile.values(attribute))
+        return values
+
+    def find(self, attribute, value):
+        # Returns the targets whose attribute equals value, in list order
+        if attribute not in self.indexes:
+            return [t for t in self if getattr(t, attribute) == value]
+        return [self[i] for i in self.positions(attribute, value)]
+
+
+def get_ecu_protocol(protocol):
+    # Protocol family used for nearest version matches
+    if protocol.startswith("KWP") or protocol.startswith("ISO8"):
+        return "KWP"
+    return "CAN"
+
+
+class Ecu_matcher:
+    '''Identification index of a target list
+       Gives the results of a walk of the list with Ecu_ident.checkWith and checkApproximate
+    '''
+
+    def __init__(self, targets):
+        self.size = len(targets)
+        # (protocol, diagversion, supplier, soft) -> [(position, version, target)]
+        self.exact = {}
+        # (protocol, supplier, soft) of the targets that could match approximately
+        self.candidates = set()
+        # (ecu protocol, supplier, soft) -> sorted [(version, position, target)], and their versions
+        self.approximate = {}
+        self.versions = {}
+        # protocol -> positions of its targets
+        self.positions = {}
+
+        for position, target in enumerate(targets):
+            self.positions.setdefault(target.protocol, []).append(position)
+            if target.diagversion == "":
+                continue
+            supplier = target.supplier.strip()
+            soft = target.soft.strip()
+            self.candidates.add((target.protocol, supplier, soft))
+            try:
+                key = (target.protocol, int("0x" + target.diagversion, 16), supplier, soft)
+                self.exact.setdefault(key, []).append((position, target.version.strip(), target))
+            except ValueError:
+                pass
+            try:
+                entry = (int("0x" + target.version, 16), position, target)
+            except ValueError:
+                continue
+            key = (get_ecu_protocol(target.protocol), supplier, soft)
+            self.approximate.setdefault(key, []).append(entry)
+
+        for key, entries in self.approximate.items():
+            entries.sort(key=lambda e: e[:2])
+            self.versions[key] = [e[0] for e in entries]
+
+    def protocols(self, protocol):
+        # Target protocols checked for a "CAN" or "KWP" scan
+        return [p for p in self.positions
+                if not (p == "CAN" and protocol != "CAN") and not (p.startswith("KWP") and protocol != "KWP")]
+
+    def match(self, diagversion, supplier, soft, version, protocol):
+        '''Returns the first exactly matching target and the number of targets checked before, or (None, 0)'''
+        diagversion = int("0x" + diagversion, 16)
+        supplier = supplier.strip()
+        soft = soft.strip()
+        version = version.strip()
+        protocols = self.protocols(protocol)
+
+        found = None
+        # Targets values are prefixes of the ECU ones
+        for p in protocols:
+            for i in range(len(supplier) + 1):
+                for j in range(len(soft) + 1):
+                    for position, tgt_version, target in self.exact.get((p, diagversion, supplier[:i], soft[:j]), ()):
+                        if found is not None and position > found[0]:
+                            break
+                        if version.startswith(tgt_version):
+                            found = (position, target)
+                            break
+        if found is None:
+            return None, 0
+        return found[1], sum(bisect.bisect_left(self.positions[p], found[0]) for p in protocols)
+
+    def has_approximate(self, supplier, soft, protocol):
+        supplier = supplier.strip()
+        soft = soft.strip()
+        return any((p, supplier, soft) in self.candidates for p in self.protocols(protocol))
+
+    def nearest(self, supplier, soft, version, protocol):
+        '''Returns the approximately matching target with the closest version, or None'''
+        key = (protocol, supplier.strip(), soft.strip())
+        if key not in self.approximate:
+            return None
+        entries = self.approximate[key]
+        versions = self.versions[key]
+        try:
+            value = int("0x" + version, 16)
+        except ValueError:
+            return None
+
+        # Closest version on each side, the first target in list order wins a tie
+        kept = None
+        i = bisect.bisect_left(versions, value)
+        if i > 0:
+            first = bisect.bisect_left(versions, versions[i - 1])
+            kept = (value - entries[first][0], entries[first][1], entries[first][2])
+        if i < len(entries):
+            right = (entries[i][0] - value, entries[i][1], entries[i][2])
+            if kept is None or right[:2] < kept[:2]:
+                kept = right
+        if kept[0] >= 0xFFFFFF:
+            return None
+        return kept[2]
+
+
+# Startup snapshot of the whole vehicles database, rebuilt when one of its inputs changes
+snapshot_file = "ddt4all_data/ecudb.snapshot"
+snapshot_version = 1
+
+
+def get_file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_database_fingerprint(compiled=True):
+    '''Sizes, dates and CRCs of every input of Ecu_database'''
+    zipdb = None
+    if ecu_zip.exists():
+        info = ecu_zip.getinfo("db.json")
+        zipdb = (info.CRC, info.file_size)
+    return (snapshot_version, marshal.version, zipdb,
+            [(f, get_file_stamp(f)) for f in sorted(glob.glob("./json/*.json.targets"))],
+            options.ecus_dir, get_file_stamp(options.ecus_dir + "/eculist.xml"),
+            get_file_stamp(compiled_db_file) if compiled else None,
+            sorted(elm.addressing.groups.items()))
+
+
+# Index of the projects.json vehicle projects, only the projects in use are decoded
+projects_file = "ddt4all_data/projects.json"
+projects_index_file = "ddt4all_data/projects.idx"
+projects_index_version = 1
+
+
+class Vehicle_projects:
+    '''Lazy view of projects.json
+
+    The byte range of every project is kept in projects.idx, so a startup
+    only decodes the project list and the projects which are actually used.
+    '''
+
+    def __init__(self, filename=projects_file, indexfile=projects_index_file):
+        self.filename = filename
+        self.indexfile = indexfile
+        self.cache = {}
+        stamp = get_file_stamp(filename)
+        if stamp is None:
+            raise FileNotFoundError(filename)
+        entries = self.load_index(stamp)
+        if entries is None:
+            entries = self.build_index()
+            self.save_index(stamp, entries)
+        self.codes = OrderedDict()
+        self.ranges = {}
+        for name, code, offset, length in entries:
+            self.codes[name] = code
+            self.ranges[name] = (offset, length)
+
+    def load_index(self, stamp):
+        if not os.path.exists(self.indexfile):
+            return None
+        try:
+            with open(self.indexfile, "rb") as f:
+                version, index_stamp, entries = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            print(_("Cannot read projects index"), e)
+            return None
+        if version != projects_index_version or index_stamp != stamp:
+            return None
+        return entries
+
+    def save_index(self, stamp, entries):
+        try:
+            with open(self.indexfile + ".tmp", "wb") as f:
+                f.write(marshal.dumps((projects_index_version, stamp, entries)))
+            os.replace(self.indexfile + ".tmp", self.indexfile)
+        except (OSError, ValueError) as e:
+            print(_("Cannot write projects index"), e)
+
+    def build_index(self):
+        # Walks the {"projects": {name: project}} object, decoding it once,
+        # and records where each project is stored in the UTF-8 file.
+        # Line endings are kept as they are so that the offsets match the file bytes.
+        with open(self.filename, "r", encoding="UTF-8", newline="") as f:
+            data = f.read()
+        decoder = json.JSONDecoder()
+        whitespace = re.compile(r"[ \t\n\r]*")
+
+        def skip(pos, expected=None):
+            pos = whitespace.match(data, pos).end()
+            if expected is not None:
+                if data[pos:pos + 1] != expected:
+                    raise json.JSONDecodeError("Expecting '%s'" % expected, data, pos)
+                pos = whitespace.match(data, pos + 1).end()
+            return pos
+
+        entries = []
+        pos = skip(0, "{")
+        key, pos = decoder.raw_decode(data, pos)
+        if key != "projects":
+            raise KeyError("projects")
+        pos = skip(skip(pos, ":"), "{")
+        # Character offsets are turned into byte offsets as the walk goes
+        char_pos, byte_pos = 0, 0
+        while data[pos:pos + 1] != "}":
+            name, pos = decoder.raw_decode(data, pos)
+            start = skip(pos, ":")
+            project, end = decoder.raw_decode(data, start)
+            byte_pos += len(data[char_pos:start].encode("UTF-8"))
+            length = len(data[start:end].encode("UTF-8"))
+            entries.append((name, str(project["code"]), byte_pos, length))
+            char_pos, byte_pos = end, byte_pos + length
+            pos = skip(end)
+            if data[pos:pos + 1] == ",":
+                pos = skip(pos + 1)
+        return entries
+
+    def __contains__(self, name):
+        return name in self.codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def names(self):
+        return list(self.codes.keys())
+
+    def code(self, name):
+        return self.codes[name]
+
+    def project(self, name):
+        # Decoded on first use, then kept for the session
+        if name in self.cache:
+            return self.cache[name]
+        offset, length = self.ranges[name]
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            project = json.loads(f.read(length).decode("UTF-8"))
+        self.cache[name] = project
+        return project
+
+
 class Ecu_database:
     jsonfile = "json/ecus.zip"
+    snapshot_attributes = ("vehiclemap", "numecu", "available_addr_kwp", "available_addr_can",
+                           "addr_group_mapping_long", "addr_group_mapping")
+
+    def __init__(self, forceXML=False, compiled=True, custom=True, snapshot=True):
+        # compiled : use the compiled database if it matches ecu.zip
+        # custom : also load the json/*.targets and eculist.xml targets
+        # snapshot : use the startup snapshot, saved again if it was out of date
+        self.matcher = None
+        fingerprint = None
+        if snapshot and custom and not forceXML:
+            fingerprint = get_database_fingerprint(compiled)
+            if self.load_snapshot(fingerprint):
+                return
 
-    def __init__(self, forceXML=False):
-        global ecu_ident, protocol
-        self.targets = []
+        self.targets = Ecu_target_list()
         self.vehiclemap = {}
         self.numecu = 0
-        self.available_addr_kwp = []
-        self.available_addr_can = []
+        self.available_addr_kwp = set()
+        self.available_addr_can = set()
         self.addr_group_mapping_long = {}
         self.addr_group_mapping = {}
 
-        for k, v in addressing.items():
+        for k, v in elm.addressing.groups.items():
             self.addr_group_mapping[k] = v[0]
             self.addr_group_mapping_long[k] = v[1]
 
-        xmlfile = options.ecus_dir + "/eculist.xml"
+        if custom:
+            self.load_json_targets()
+
+        if ecu_zip.exists() and not forceXML:
+            if not compiled or not self.load_compiled_database():
+                self.load_zip_database()
+
+        if custom:
+            self.load_xml_targets()
 
+        if fingerprint is not None:
+            self.save_snapshot(fingerprint)
+
+    def load_snapshot(self, fingerprint):
+        # Returns False if there is no up to date snapshot
+        if not os.path.exists(snapshot_file):
+            return False
+        try:
+            with open(snapshot_file, "rb") as f:
+                snapshot_fingerprint, state = marshal.loads(f.read())
+            if snapshot_fingerprint != fingerprint:
+                return False
+            targets = Ecu_target_list()
+            targets.set_state(state.pop("targets"))
+        except (OSError, EOFError, ValueError, TypeError, KeyError, struct.error) as e:
+            print(_("Cannot read database snapshot"), e)
+            return False
+        self.targets = targets
+        for name, value in state.items():
+            setattr(self, name, value)
+        return True
+
+    def save_snapshot(self, fingerprint):
+        state = {name: getattr(self, name) for name in self.snapshot_attributes}
+        state["targets"] = self.targets.get_state()
+        try:
+            with open(snapshot_file + ".tmp", "wb") as f:
+                f.write(marshal.dumps((fingerprint, state)))
+            os.replace(snapshot_file + ".tmp", snapshot_file)
+        except (OSError, ValueError) as e:
+            print(_("Cannot write database snapshot"), e)
+
+    def load_json_targets(self):
         jsonecu_files = glob.glob("./json/*.json.targets")
         for jsonecu_file in jsonecu_files:
             self.numecu += 1
@@ -1212,11 +2316,9 @@ class Ecu_database:
                 addr = ecu_dict['address']
 
                 if 'KWP' in ecu_dict['protocol']:
-                    if addr not in self.available_addr_kwp:
-                        self.available_addr_kwp.append(str(addr))
+                    self.available_addr_kwp.add(str(addr))
                 elif 'CAN' in ecu_dict['protocol']:
-                    if addr not in self.available_addr_can:
-                        self.available_addr_can.append(str(addr))
+                    self.available_addr_can.add(str(addr))
 
                 if str(addr) not in self.addr_group_mapping:
                     print(_("Adding group "), addr, ecu_dict['group'])
@@ -1235,49 +2337,79 @@ class Ecu_database:
 
                 self.targets.append(ecu_ident)
 
-        if os.path.exists("ecu.zip") and not forceXML:
-            zf = zipfile.ZipFile("ecu.zip", mode='r')
-            jsdb = zf.read("db.json")
-            dbdict = json.loads(jsdb)
-            for href, targetv in dbdict.items():
-                self.numecu += 1
-                ecugroup = targetv['group']
-                ecuprotocol = targetv['protocol']
-                ecuprojects = targetv['projects']
-                ecuaddress = targetv['address']
-                ecuname = targetv['ecuname']
-
-                if 'KWP' in ecuprotocol:
-                    if not ecuaddress in self.available_addr_kwp:
-                        self.available_addr_kwp.append(str(ecuaddress))
-                elif 'CAN' in ecuprotocol:
-                    if not ecuaddress in self.available_addr_can:
-                        self.available_addr_can.append(str(ecuaddress))
-
-                if str(ecuaddress) not in self.addr_group_mapping:
-                    self.addr_group_mapping[ecuaddress] = targetv['group']
-
-                if len(targetv['autoidents']) == 0:
-                    ecu_ident = Ecu_ident("", "", "", "", ecuname, ecugroup, href, ecuprotocol,
+    def load_zip_database(self):
+        jsdb = ecu_zip.read("db.json")
+        dbdict = json.loads(jsdb)
+        for href, targetv in dbdict.items():
+            self.numecu += 1
+            ecugroup = targetv['group']
+            ecuprotocol = targetv['protocol']
+            ecuprojects = targetv['projects']
+            ecuaddress = targetv['address']
+            ecuname = targetv['ecuname']
+
+            if 'KWP' in ecuprotocol:
+                self.available_addr_kwp.add(str(ecuaddress))
+            elif 'CAN' in ecuprotocol:
+                self.available_addr_can.add(str(ecuaddress))
+
+            if str(ecuaddress) not in self.addr_group_mapping:
+                self.addr_group_mapping[ecuaddress] = targetv['group']
+
+            if len(targetv['autoidents']) == 0:
+                ecu_ident = Ecu_ident("", "", "", "", ecuname, ecugroup, href, ecuprotocol,
+                                      ecuprojects, ecuaddress, True)
+                self.targets.append(ecu_ident)
+            else:
+                for target in targetv['autoidents']:
+                    ecu_ident = Ecu_ident(target['diagnostic_version'], target['supplier_code'],
+                                          target['soft_version'], target['version'],
+                                          ecuname, ecugroup, href, ecuprotocol,
                                           ecuprojects, ecuaddress, True)
+
                     self.targets.append(ecu_ident)
-                else:
-                    for target in targetv['autoidents']:
-                        ecu_ident = Ecu_ident(target['diagnostic_version'], target['supplier_code'],
-                                              target['soft_version'], target['version'],
-                                              ecuname, ecugroup, href, ecuprotocol,
-                                              ecuprojects, ecuaddress, True)
 
-                        self.targets.append(ecu_ident)
+            for proj in ecuprojects:
+                projname = proj[0:3].upper()
+                if not projname in self.vehiclemap:
+                    self.vehiclemap[projname] = []
+                self.vehiclemap[projname].append((ecuprotocol, ecuaddress))
 
-                for proj in ecuprojects:
-                    projname = proj[0:3].upper()
-                    if not projname in self.vehiclemap:
-                        self.vehiclemap[projname] = []
-                    self.vehiclemap[projname].append((ecuprotocol, ecuaddress))
+            self.targets.append(ecu_ident)
 
-                self.targets.append(ecu_ident)
+    def load_compiled_database(self):
+        # Returns False if there is no up to date compiled database
+        if not os.path.exists(compiled_db_file):
+            return False
+        try:
+            dbfile = Ecu_database_file(compiled_db_file)
+        except (OSError, ValueError, struct.error) as e:
+            print(_("Cannot read compiled database"), e)
+            return False
 
+        info = ecu_zip.getinfo("db.json")
+        if (dbfile.crc, dbfile.size) != (info.CRC, info.file_size):
+            print(_("Compiled database does not match ecu.zip, loading db.json"))
+            dbfile.close()
+            return False
+
+        self.numecu += dbfile.numecu
+        self.available_addr_kwp.update(dbfile.kwp_addresses())
+        self.available_addr_can.update(dbfile.can_addresses())
+        for ecuaddress, ecugroup, targets in dbfile.addresses():
+            if ecuaddress not in self.addr_group_mapping:
+                self.addr_group_mapping[ecuaddress] = ecugroup
+        for projname, pairs in dbfile.projects():
+            if not projname in self.vehiclemap:
+                self.vehiclemap[projname] = []
+            self.vehiclemap[projname].extend(pairs)
+
+        self.targets.extend_compiled(dbfile)
+        return True
+
+    def load_xml_targets(self):
+        global ecu_ident, protocol
+        xmlfile = options.ecus_dir + "/eculist.xml"
         if os.path.exists(xmlfile):
             xdom = xml.dom.minidom.parse(xmlfile)
             self.xmldoc = xdom.documentElement
@@ -1304,11 +2436,9 @@ class Ecu_database:
                         self.addr_group_mapping[str(address)] = group
 
                     if 'CAN' in protocol.upper():
-                        if address not in self.available_addr_can:
-                            self.available_addr_can.append(str(address))
+                        self.available_addr_can.add(str(address))
                     elif 'KWP' in protocol.upper():
-                        if address not in self.available_addr_kwp:
-                            self.available_addr_kwp.append(str(address))
+                        self.available_addr_kwp.add(str(address))
 
                     autoidents = target.getElementsByTagName("AutoIdents")
                     projectselems = target.getElementsByTagName("Projects")
@@ -1339,24 +2469,24 @@ class Ecu_database:
                             self.vehiclemap[projname].append((ecu_ident.protocol, address))
 
     def getTarget(self, name):
-        for t in self.targets:
-            if t.name == name:
-                return t
+        tgt = self.targets.find("name", name)
+        if tgt:
+            return tgt[0]
         return None
 
     def getTargets(self, name):
-        tgt = []
-        for t in self.targets:
-            if t.name == name:
-                tgt.append(t)
-        return tgt
+        return self.targets.find("name", name)
 
     def getTargetsByHref(self, href):
-        tgt = []
-        for t in self.targets:
-            if t.href == href:
-                tgt.append(t)
-        return tgt
+        return self.targets.find("href", href)
+
+    def getTargetsByAddress(self, addr):
+        return self.targets.find("db_addr", addr)
+
+    def getMatcher(self):
+        if self.matcher is None or self.matcher.size != len(self.targets):
+            self.matcher = Ecu_matcher(self.targets)
+        return self.matcher
 
     def dump(self):
         js = []
@@ -1367,24 +2497,48 @@ class Ecu_database:
 
 
 class Ecu_scanner:
-    def __init__(self):
+    def __init__(self, background=False):
         self.totalecu = 0
         self.ecus = {}
         self.approximate_ecus = {}
-        self.ecu_database = Ecu_database()
         self.num_ecu_found = 0
         self.report_data = []
         self.qapp = None
+        # The Ecu_database, set once loaded, see ecu_database
+        self.database_future = concurrent.futures.Future()
+        self.database_load_time = 0
+        if background:
+            threading.Thread(target=self.load_database, daemon=True).start()
+        else:
+            self.load_database()
+
+    def load_database(self):
+        start = time.time()
+        try:
+            database = Ecu_database()
+        except Exception as e:
+            self.database_future.set_exception(e)
+            return
+        self.database_load_time = time.time() - start
+        self.database_future.set_result(database)
+
+    def database_ready(self):
+        return self.database_future.done()
+
+    @property
+    def ecu_database(self):
+        # Waits for the database if it is still loading
+        return self.database_future.result()
 
     def getNumEcuDb(self):
         return self.ecu_database.numecu
 
     def getNumAddr(self):
         count = []
-        for k in elm.dnat:
+        for k in elm.addressing.dnat:
             if k not in count:
                 count.append(k)
-        for k in elm.dnat_ext:
+        for k in elm.addressing.dnat_ext:
             if k not in count:
                 count.append(k)
         return len(count)
@@ -1606,7 +2760,7 @@ class Ecu_scanner:
                     if proto == u"KWP2000" and not addr in project_kwp_addresses:
                         project_kwp_addresses.append(addr)
         else:
-            project_kwp_addresses = self.ecu_database.available_addr_kwp
+            project_kwp_addresses = sorted(self.ecu_database.available_addr_kwp)
 
         if len(project_kwp_addresses) == 0:
             return
@@ -1658,8 +2812,6 @@ class Ecu_scanner:
             self.check_ecu2(diagversion, supplier, soft, version, label, addr, protocol)
 
     def check_ecu2(self, diagversion, supplier, soft, version, label, addr, protocol):
-        global tgt
-        approximate_ecu = []
         found_exact = False
         found_approximate = False
         if addr in self.ecu_database.addr_group_mapping:
@@ -1667,61 +2819,33 @@ class Ecu_scanner:
         else:
             ecu_type = "UNKNOWN"
 
-        targetNum = 0
-        for target in self.ecu_database.targets:
-            if target.protocol == "CAN" and protocol != "CAN":
-                continue
-            if target.protocol.startswith("KWP") and protocol != "KWP":
-                continue
-
-            if target.checkWith(diagversion, supplier, soft, version, addr):
-                ecuname = "[ " + target.group + " ] " + target.name
-
-                self.ecus[ecuname] = target
-                self.num_ecu_found += 1
-                if label is not None:
-                    label.setText(_("Found: ") + " %i ECU" % self.num_ecu_found)
-                found_exact = True
-                href = target.href
-                line = "<font color='green'>" + _("Identified ECU") + " [%s]@%s : %s DIAGVERSION [%s]" \
-                                                                      "SUPPLIER [%s] SOFT [%s] VERSION [%s] {%i}</font>" \
-                       % (ecu_type, target.addr, href, diagversion, supplier, soft, version, targetNum)
+        matcher = self.ecu_database.getMatcher()
+        target, targetNum = matcher.match(diagversion, supplier, soft, version, protocol)
+        if target is not None:
+            # Also records the address the ECU answered on
+            target.checkWith(diagversion, supplier, soft, version, addr)
+            ecuname = "[ " + target.group + " ] " + target.name
+
+            self.ecus[ecuname] = target
+            self.num_ecu_found += 1
+            if label is not None:
+                label.setText(_("Found: ") + " %i ECU" % self.num_ecu_found)
+            found_exact = True
+            href = target.href
+            line = "<font color='green'>" + _("Identified ECU") + " [%s]@%s : %s DIAGVERSION [%s]" \
+                                                                  "SUPPLIER [%s] SOFT [%s] VERSION [%s] {%i}</font>" \
+                   % (ecu_type, target.addr, href, diagversion, supplier, soft, version, targetNum)
 
-                options.main_window.logview.append(line)
-                break
-            elif target.checkApproximate(diagversion, supplier, soft, addr):
-                approximate_ecu.append(target)
-                found_approximate = True
-
-            targetNum += 1
+            options.main_window.logview.append(line)
+        else:
+            found_approximate = matcher.has_approximate(supplier, soft, protocol)
 
         # Try to find the closest possible version of an ECU
         if not found_exact and found_approximate:
-            min_delta_version = 0xFFFFFF
-            kept_ecu = None
-            for tgt in approximate_ecu:
-                ecu_protocol = 'CAN'
-                if tgt.protocol.startswith("KWP"):
-                    ecu_protocol = "KWP"
-                # Shouldn't happen, but...
-                if tgt.protocol.startswith("ISO8"):
-                    ecu_protocol = "KWP"
-                if ecu_protocol != protocol:
-                    continue
-
-                # If version contains ASCII characters, I can do nothing for you...
-                try:
-                    int_version = int('0x' + version, 16)
-                    int_tgt_version = int('0x' + tgt.version, 16)
-                except ValueError:
-                    continue
-
-                delta = abs(int_tgt_version - int_version)
-                if delta < min_delta_version:
-                    min_delta_version = delta
-                    kept_ecu = tgt
-
+            kept_ecu = matcher.nearest(supplier, soft, version, protocol)
             if kept_ecu:
+                # Records the address the ECU answered on
+                kept_ecu.checkApproximate(diagversion, supplier, soft, addr)
                 self.approximate_ecus[kept_ecu.name] = kept_ecu
                 self.num_ecu_found += 1
                 if label is not None:
@@ -1732,7 +2856,7 @@ class Ecu_scanner:
                 # accessbbitity blue color for reason in window bad reader
                 line = f"<font color='blue'>{text} {ecu_type} {text1} :" \
                        "%s DIAGVERSION [%s] SUPPLIER [%s] SOFT [%s] VERSION [%s instead %s]</font>" \
-                       % (kept_ecu.name, diagversion, supplier, soft, version, tgt.version)
+                       % (kept_ecu.name, diagversion, supplier, soft, version, kept_ecu.version)
 
                 options.main_window.logview.append(line)
 
@@ -1773,10 +2897,125 @@ def make_zipfs():
         f.write(zipoutput.getvalue())
 
 
+def compile_database(output=compiled_db_file):
+    '''Writes the compiled form of the ecu.zip vehicles database, see Ecu_database_file'''
+    if not ecu_zip.exists():
+        print(_("Cannot find ecu.zip"))
+        return False
+    info = ecu_zip.getinfo("db.json")
+    db = Ecu_database(compiled=False, custom=False)
+
+    strings = set()
+    for t in db.targets:
+        strings.update((t.diagversion, t.supplier, t.soft, t.version, t.name, t.group, t.href, t.protocol,
+                        str(t.addr)))
+        strings.update(t.projects)
+    strings.update(db.available_addr_kwp)
+    strings.update(db.available_addr_can)
+    for projname, pairs in db.vehiclemap.items():
+        strings.add(projname)
+        for proto, addr in pairs:
+            strings.update((proto, str(addr)))
+    strings = sorted(strings, key=lambda s: s.encode("utf-8"))
+    index = {s: i for i, s in enumerate(strings)}
+
+    pool = []
+
+    def add_list(values):
+        pool.extend(values)
+        return len(pool) - len(values), len(values)
+
+    targets = []
+    addresses = {}
+    names = {}
+    hrefs = {}
+    for i, t in enumerate(db.targets):
+        record = [index[t.diagversion], index[t.supplier], index[t.soft], index[t.version], index[t.name],
+                  index[t.group], index[t.href], index[t.protocol], index[str(t.addr)]]
+        record.extend(add_list([index[p] for p in t.projects]))
+        targets.append(compiled_db_target.pack(*record))
+        if str(t.addr) not in addresses:
+            addresses[str(t.addr)] = (t.group, [])
+        addresses[str(t.addr)][1].append(i)
+        names.setdefault(index[t.name], []).append(i)
+        hrefs.setdefault(index[t.href], []).append(i)
+
+    address_records = [compiled_db_address.pack(index[addr], index[group], *add_list(indexes))
+                       for addr, (group, indexes) in addresses.items()]
+    project_records = []
+    for projname, pairs in db.vehiclemap.items():
+        flat = []
+        for proto, addr in pairs:
+            flat += [index[proto], index[str(addr)]]
+        poolindex, count = add_list(flat)
+        project_records.append(compiled_db_posting.pack(index[projname], poolindex, count // 2))
+    name_records = [compiled_db_posting.pack(k, *add_list(v)) for k, v in sorted(names.items())]
+    href_records = [compiled_db_posting.pack(k, *add_list(v)) for k, v in sorted(hrefs.items())]
+    kwp_list = add_list([index[a] for a in sorted(db.available_addr_kwp)])
+    can_list = add_list([index[a] for a in sorted(db.available_addr_can)])
+
+    blob = [s.encode("utf-8") for s in strings]
+    offsets = [0]
+    for b in blob:
+        offsets.append(offsets[-1] + len(b))
+    sections = [struct.pack("<%iI" % len(offsets), *offsets) + b"".join(blob),
+                b"".join(targets), b"".join(address_records), b"".join(project_records),
+                b"".join(name_records), b"".join(href_records), struct.pack("<%iI" % len(pool), *pool)]
+    counts = [len(strings), len(targets), len(address_records), len(project_records),
+              len(name_records), len(href_records), len(pool)]
+
+    header = []
+    offset = compiled_db_header.size
+    for section, count in zip(sections, counts):
+        header += [offset, count]
+        # Keep the sections 4 bytes aligned
+        offset += (len(section) + 3) & ~3
+    header += kwp_list
+    header += can_list
+
+    with open(output, "wb") as f:
+        f.write(compiled_db_header.pack(compiled_db_magic, compiled_db_version, info.CRC, info.file_size,
+                                        db.numecu, *header))
+        for section in sections:
+            f.write(section + b"\0" * (-len(section) & 3))
+    print(_("Compiled database written to ") + output + " (%i targets)" % len(targets))
+    return True
+
+
+def database_snapshot(rebuild=False):
+    fingerprint = get_database_fingerprint()
+    state = "missing"
+    if os.path.exists(snapshot_file):
+        state = "out of date"
+        try:
+            with open(snapshot_file, "rb") as f:
+                if marshal.loads(f.read())[0] == fingerprint:
+                    state = "up to date"
+        except Exception as e:
+            state = "unreadable (%s)" % e
+        print("%s : %s, %i bytes" % (snapshot_file, state, os.path.getsize(snapshot_file)))
+    else:
+        print("%s : %s" % (snapshot_file, state))
+
+    if rebuild:
+        if os.path.exists(snapshot_file):
+            os.remove(snapshot_file)
+        start = time.time()
+        db = Ecu_database()
+        print("Rebuilt with %i targets in %.1f ms" % (len(db.targets), (time.time() - start) * 1000.))
+        start = time.time()
+        db = Ecu_database()
+        print("Loaded from the snapshot in %.1f ms" % ((time.time() - start) * 1000.))
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--zipfs', action="store_true", default=None, help="Create a zip filesystem of the XMLs")
     parser.add_argument('--testdb', action="store_true", default=None, help="Test ecudatabse loading")
+    parser.add_argument('--compile-db', action="store_true", default=None,
+                        help="Create the compiled database from ecu.zip")
+    parser.add_argument('--snapshot', choices=["info", "rebuild"], default=None,
+                        help="Show the database snapshot state, or rebuild it")
     parser.add_argument('--testecufile', action="store_true", default=None, help="Test ecudatabse loading")
     parser.add_argument('--convertxml', action="store_true", default=None, help="Convert XML file to JSON")
 
@@ -1785,9 +3024,15 @@ if __name__ == '__main__':
     if args.zipfs:
         make_zipfs()
 
+    if args.compile_db:
+        compile_database()
+
     if args.testdb:
         db = Ecu_database()
 
+    if args.snapshot:
+        database_snapshot(args.snapshot == "rebuild")
+
     if args.convertxml:
         db = Ecu_database()
 
@@ -6,13 +6,18 @@
    Borrowed code from PyRen (modified for this use)
 '''
 
+import atexit
+import json
+import math
 import os
 import re
+import select
 import string
 import sys
 import time
 import threading
 import platform
+from collections import deque
 from datetime import datetime
 
 import serial
@@ -25,10 +30,45 @@ _ = options.translator('ddt4all')
 dnat_entries = {"E7": "7E4", "E8": "644"}
 snat_entries = {"E7": "7EC", "E8": "5C4"}
 
-snat = dnat_entries
-snat_ext = {}
-dnat = snat_entries
-dnat_ext = {}
+
+class Addressing:
+    '''Addressing of the selected project
+       dnat/snat map ECU addresses to their CAN ids, the reverse maps use upper case ids
+       groups maps ECU addresses to their (short name, long name)
+    '''
+
+    def __init__(self):
+        self.project = None
+        self.set({}, dnat_entries, snat_entries, {}, {})
+
+    def set(self, groups, snat, dnat, snat_ext, dnat_ext):
+        self.groups = groups
+        self.snat = snat
+        self.dnat = dnat
+        self.snat_ext = snat_ext
+        self.dnat_ext = dnat_ext
+        self.snat_reverse = self.reverse(snat)
+        self.dnat_reverse = self.reverse(dnat)
+        self.snat_ext_reverse = self.reverse(snat_ext)
+        self.dnat_ext_reverse = self.reverse(dnat_ext)
+
+    def load(self, project):
+        # project is a projects.json entry, maps are only rebuilt if it changed
+        if project is self.project:
+            return
+        self.project = project
+        self.set(project["addressing"], project["snat"], project["dnat"], project["snat_ext"], project["dnat_ext"])
+
+    @staticmethod
+    def reverse(nat):
+        # The first address using a CAN id wins
+        reverse = {}
+        for addr, canid in nat.items():
+            reverse.setdefault(canid.upper(), addr)
+        return reverse
+
+
+addressing = Addressing()
 
 # Code snippet from https://github.com/rbei-etas/busmaster
 negrsp = {"10": "NR: General Reject",
@@ -203,39 +243,23 @@ cmdb = '''
 '''
 
 def addr_exist(addr):
-    result = True
-    if addr not in dnat:
-        if addr not in dnat_ext:
-            result = False
-    return result
+    return addr in addressing.dnat or addr in addressing.dnat_ext
 
 
 def get_can_addr(txa):
-    for d in dnat.keys():
-        if dnat[d].upper() == txa.upper():
-            return d
-    return None
+    return addressing.dnat_reverse.get(txa.upper())
 
 
 def get_can_addr_ext(txa):
-    for d in dnat_ext.keys():
-        if dnat_ext[d].upper() == txa.upper():
-            return d
-    return None
+    return addressing.dnat_ext_reverse.get(txa.upper())
 
 
 def get_can_addr_snat(txa):
-    for d in snat.keys():
-        if snat[d].upper() == txa.upper():
-            return d
-    return None
+    return addressing.snat_reverse.get(txa.upper())
 
 
 def get_can_addr_snat_ext(txa):
-    for d in snat_ext.keys():
-        if snat_ext[d].upper() == txa.upper():
-            return d
-    return None
+    return addressing.snat_ext_reverse.get(txa.upper())
 
 
 def item_count(items):
@@ -370,12 +394,21 @@ def is_els27_device(port, timeout=2):
     
     return False, "No ELS27 response at any baud rate"
 
+def release_elm():
+    # The tester present thread keeps using the device, it must stop before options.elm is replaced
+    if options.elm is not None and hasattr(options.elm, "set_tester_present"):
+        options.elm.set_tester_present("")
+    if isinstance(options.elm, ELM) and options.elm.l1_cache is not None:
+        options.elm.l1_cache.save()
+
+
 def reconnect_elm():
     """Enhanced reconnection with device-specific handling"""
     ports = get_available_ports()
     current_adapter = "STD"
     if options.elm:
         current_adapter = options.elm.adapter_type
+    release_elm()
     
     # Try to reconnect to the same port first
     if options.port_name:
@@ -429,6 +462,59 @@ def errorval(val):
         return negrsp[val]
 
 
+class Response:
+    '''Decoded ECU response, see ELM.request_bytes'''
+
+    POSITIVE = "positive"
+    NEGATIVE = "negative"
+    TIMEOUT = "timeout"
+    FRAMING = "framing"
+
+    def __init__(self, status, data=b'', nrc=None, text=''):
+        self.status = status
+        # Response payload, service id included
+        self.data = data
+        # Negative response code (int)
+        self.nrc = nrc
+        # Response as returned by the string API, for the logs
+        self.text = text
+
+    def is_positive(self):
+        return self.status == Response.POSITIVE
+
+    def nrc_text(self):
+        if self.nrc is None:
+            return ""
+        return errorval("%02X" % self.nrc)
+
+
+def parse_response(rsp):
+    '''Builds a Response from a request() response string'''
+    text = rsp
+    rsp = rsp.strip()
+
+    if rsp.startswith("WRONG RESPONSE"):
+        # Negative responses are reported as "WRONG RESPONSE : error(7F2112)"
+        m = re.search(r'\((7F[0-9A-F]{4})', rsp.upper())
+        if m:
+            data = bytes.fromhex(m.group(1))
+            return Response(Response.NEGATIVE, data, data[2], text)
+        return Response(Response.FRAMING, text=text)
+
+    if len(rsp) == 0 or "NO DATA" in rsp or "TIMEOUT" in rsp:
+        return Response(Response.TIMEOUT, text=text)
+
+    try:
+        data = bytes.fromhex(rsp)
+    except ValueError:
+        return Response(Response.FRAMING, text=text)
+
+    if len(data) >= 3 and data[0] == 0x7F:
+        return Response(Response.NEGATIVE, data, data[2], text)
+
+    return Response(Response.POSITIVE, data, text=text)
+
+
 class Port:
     '''Enhanced serial port and TCP connection handler
        Supports USB, Bluetooth, WiFi OBD-II devices with cross-platform compatibility
@@ -446,14 +532,22 @@ class Port:
 
     hdr = None
     _lock = None  # Thread lock for connection safety
+    rx_buffer = None  # Received bytes not consumed yet
+    rx_times = []  # (offset, time) of the chunks read by the last read_until
+    rx_chunk = 4096
+    poll_interval = 0.002  # when the port cannot be waited on
     tcp_needs_reconnect = False
+    tcp_silence_timeout = 5  # s without data before a reconnection, as the socket timeout did
     reconnect_attempts = 0
+    connections = 0  # (re)connections made by all ports
+    connection_id = 0  # number of the current connection
     max_reconnect_attempts = 3
 
     def __init__(self, portName, speed, adapter_type):
         options.elm_failed = False
         self.adapter_type = adapter_type
         self._lock = threading.Lock()
+        self.rx_buffer = bytearray()
         self.reconnect_attempts = 0
 
         portName = portName.strip()
@@ -528,6 +622,8 @@ class Port:
             
             print(f"Serial port opened: {self.hdr}")
             self.connectionStatus = True
+            Port.connections += 1
+            self.connection_id = Port.connections
             
             # Save successful connection settings
             if self.connectionStatus:
@@ -582,6 +678,7 @@ class Port:
                 print(f"Error closing port: {e}")
             finally:
                 self.hdr = None
+                self.rx_buffer = bytearray()
 
     def init_wifi(self, reinit=False):
         '''
@@ -595,6 +692,7 @@ class Port:
         try:
             if reinit and self.hdr:
                 self.hdr.close()
+            self.rx_buffer = bytearray()
                 
             self.hdr = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.hdr.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -613,6 +711,8 @@ class Port:
                 self.hdr.setblocking(True)
                 
             self.connectionStatus = True
+            Port.connections += 1
+            self.connection_id = Port.connections
             self.tcp_needs_reconnect = False
             self.reconnect_attempts = 0
             print(f"WiFi connection established: {self.ipaddr}:{self.tcpprt}")
@@ -636,17 +736,35 @@ class Port:
             options.elm_failed = True
             self.connectionStatus = False
 
-    def read_byte(self):
-        """Enhanced read_byte with better error handling and reconnection"""
+    def read_serial(self):
+        # Everything already received by the serial driver, without blocking
+        if not self.hdr:
+            return b""
+        if hasattr(self.hdr, 'in_waiting'):
+            waiting = self.hdr.in_waiting
+        elif hasattr(self.hdr, 'inWaiting'):
+            waiting = self.hdr.inWaiting()
+        else:
+            waiting = 0
+        if waiting:
+            return self.hdr.read(waiting)
+        return b""
+
+    def read_available(self):
+        """Reads what the adapter has sent so far, b"" if nothing, None on error"""
         with self._lock:
             try:
-                byte = b""
+                data = b""
                 if self.portType == 1:  # TCP/WiFi
                     import socket
                     try:
-                        byte = self.hdr.recv(1)
+                        data = self.hdr.recv(self.rx_chunk)
+                        if not data:
+                            # A readable socket with nothing to read was closed by the adapter
+                            self.tcp_needs_reconnect = True
+                            return None
                         if options.debug:
-                            print(f"WiFi recv: {byte}")
+                            print(f"WiFi recv: {data}")
                     except socket.timeout:
                         self.tcp_needs_reconnect = True
                         return None
@@ -656,21 +774,17 @@ class Port:
                         return None
                 elif self.portType == 2:  # Bluetooth
                     if self.droid and self.droid.bluetoothReadReady():
-                        byte = self.droid.bluetoothRead(1).result
+                        data = self.droid.bluetoothRead(self.rx_chunk).result
                     else:
                         # Fallback to serial read for Bluetooth-serial adapters
-                        if self.hdr and hasattr(self.hdr, 'in_waiting') and self.hdr.in_waiting:
-                            byte = self.hdr.read(1)
+                        data = self.read_serial()
                 else:  # Serial/USB
-                    if self.hdr and hasattr(self.hdr, 'in_waiting') and self.hdr.in_waiting:
-                        byte = self.hdr.read(1)
-                    elif self.hdr and hasattr(self.hdr, 'inWaiting') and self.hdr.inWaiting():
-                        byte = self.hdr.read(1)
-                        
-                return byte
-                
+                    data = self.read_serial()
+
+                return data
+
             except serial.SerialException as e:
-                print(f"Serial error in read_byte: {e}")
+                print(f"Serial error in read_available: {e}")
                 self.connectionStatus = False
                 return None
             except Exception as e:
@@ -681,6 +795,41 @@ class Port:
                 self.close()
                 return None
 
+    def wait_readable(self, timeout):
+        '''Sleeps until the adapter sent something, at most timeout seconds
+
+        Returns False if nothing arrived, True if there may be data to read.
+        '''
+        if options.simulation_mode:
+            return True
+        if timeout <= 0:
+            return False
+        hdr = self.hdr
+        if hdr is None:
+            time.sleep(timeout)
+            return False
+        try:
+            # Sockets, and serial ports on posix, can be waited on directly
+            if self.portType == 1 or (os.name == 'posix' and not self.droid and hasattr(hdr, 'fileno')):
+                readable, writable, failed = select.select([hdr], [], [], timeout)
+                return bool(readable)
+        except (OSError, ValueError, TypeError):
+            pass
+        # Serial ports elsewhere have no waitable handle, poll them gently
+        time.sleep(min(timeout, self.poll_interval))
+        return True
+
+    def read_byte(self):
+        """Next received byte, b"" if there is none yet, None on error"""
+        if not self.rx_buffer:
+            data = self.read_available()
+            if not data:
+                return data
+            self.rx_buffer += data
+        byte = bytes(self.rx_buffer[:1])
+        del self.rx_buffer[:1]
+        return byte
+
     def read(self):
         """Enhanced read method with better error handling"""
         try:
@@ -703,6 +852,67 @@ class Port:
             print(f"Error in read(): {e}")
             return None
 
+    def read_until(self, pattern, time_out=1, crlf=False):
+        '''Reads up to and including pattern, returns (data, found)
+
+        Whole chunks are read from the port, the bytes following the pattern
+        are kept for the next read. With crlf, a \\r in the stream matches \\n.
+        '''
+        deadline = time.monotonic() + time_out
+        data = bytearray()
+        text = bytearray()  # data with \r translated, same length
+        start = 0
+        self.rx_times = []
+
+        while True:
+            if self.rx_buffer:
+                chunk = bytes(self.rx_buffer)
+                self.rx_buffer.clear()
+            elif not options.simulation_mode:
+                chunk = b""
+                if self.wait_readable(deadline - time.monotonic()):
+                    chunk = self.read_available()
+                    if chunk is None:
+                        # Read error or closed connection, waiting again would return at once
+                        return bytes(data), False
+            else:
+                chunk = b'>'
+
+            if chunk:
+                self.rx_times.append((len(data), time.time()))
+                data += chunk
+                text += chunk.replace(b'\r', b'\n') if crlf else chunk
+                pos = text.find(pattern, start)
+                if pos >= 0:
+                    end = pos + len(pattern)
+                    self.rx_buffer[0:0] = data[end:]
+                    return bytes(data[:end]), True
+                # Only the tail can still hold the start of the pattern
+                start = max(0, len(text) - len(pattern) + 1)
+
+            if time.monotonic() >= deadline:
+                if not data and self.portType == 1 and time_out >= self.tcp_silence_timeout:
+                    # Nothing at all from the WiFi adapter, short waits are not a lost connection
+                    self.tcp_needs_reconnect = True
+                return bytes(data), False
+
+    def arrival_time(self, offset):
+        '''Time the byte at offset of the last read_until data was received'''
+        arrival = None
+        for start, t in self.rx_times:
+            if start > offset:
+                break
+            arrival = t
+        return arrival
+
+    def readline(self, time_out=1):
+        '''Next \\r or \\n terminated line without its terminator, None on timeout'''
+        data, found = self.read_until(b'\n', time_out, crlf=True)
+        if not found:
+            self.rx_buffer[0:0] = data
+            return None
+        return data[:-1].decode('latin1')
+
     def change_rate(self, rate):
         self.hdr.baudrate = rate
 
@@ -743,52 +953,19 @@ class Port:
                 return None
 
     def expect_carriage_return(self, time_out=1):
-        tb = time.time()  # start time
-        self.buff = b""
-
-        while True:
-            if not options.simulation_mode:
-                byte = self.read_byte()
-            else:
-                byte = '>'
-
-            if byte:
-                self.buff += byte
-            tc = time.time()
-
-            if b'\r' in self.buff:
-                return self.buff.decode('utf8')
-
-            if (tc - tb) > time_out:
-                return self.buff + b"TIMEOUT"
-
-        # self.close()
-        # self.connectionStatus = False
-        # return ''
+        data, found = self.read_until(b'\r', time_out)
+        self.buff = data
+        if found:
+            return data.decode('utf8')
+        return data + b"TIMEOUT"
 
     def expect(self, pattern, time_out=1):
-        tb = time.time()  # start time
-        self.buff = ""
-
-        while True:
-            if not options.simulation_mode:
-                byte = self.read()
-            else:
-                byte = '>'
-
-            if byte == '\r':
-                byte = '\n'
-            if byte:
-                self.buff += byte
-            tc = time.time()
-            if pattern in self.buff:
-                return self.buff
-            if (tc - tb) > time_out:
-                return self.buff + _("TIMEOUT")
-
-        # self.close()
-        # self.connectionStatus = False
-        # return ''
+        # \r is reported as \n, as the ELM ends its lines with \r only
+        data, found = self.read_until(pattern.encode('utf-8'), time_out, crlf=True)
+        self.buff = data.decode('latin1').replace('\r', '\n')
+        if found:
+            return self.buff
+        return self.buff + _("TIMEOUT")
 
     def check_elm(self):
 
@@ -800,29 +977,301 @@ class Port:
 
             self.hdr.baudrate = s
             self.hdr.flushInput()
+            self.rx_buffer.clear()
             self.write("\r")
 
             # search > string
-            tb = time.time()  # start time
-            self.buff = ""
-            while (True):
-                if not options.simulation_mode:
-                    byte = self.read()
-                else:
-                    byte = '>'
-                self.buff += byte
-                tc = time.time()
-                if '>' in self.buff:
-                    options.port_speed = s
-                    print("\n" + _("Start COM speed :"), s)
-                    self.hdr.timeout = self.portTimeout
-                    return True
-                if (tc - tb) > 1:
-                    break
+            data, found = self.read_until(b'>', 1)
+            self.buff = data.decode('latin1')
+            if found:
+                options.port_speed = s
+                print("\n" + _("Start COM speed :"), s)
+                self.hdr.timeout = self.portTimeout
+                return True
         print("\n" + _("ELM not responding"))
         return False
 
 
+# L2 cache: seconds a response is kept, by request class, None for the whole session
+cache_ttl = {"identification": None, "calibration": 300, "live": 0}
+# Identification reads: UDS F1xx and OBD F8xx DIDs, 2180 and KWP readEcuIdentification
+identification_requests = ("22F1", "22F8", "2180", "1A")
+# Write services, with the read service and the length of the id they write
+write_services = {"2E": ("22", 4), "3B": ("21", 2)}
+# After these, nothing cached for the ECU can be trusted (reset, routines, downloads)
+cache_reset_services = ("11", "31", "34", "36", "37", "3D")
+
+
+# Adaptive AT ST, used while the CAN timeout is 0 (AUTO): a percentile of the measured
+# ECU latency plus a margin, in 4 ms steps
+default_can_timeout = 0x32  # ELM default, 200 ms
+latency_samples = 50
+latency_min_samples = 10
+latency_percentile = 0.95
+latency_margin = 0.03
+latency_max_backoff = 8
+latency_backoff_decay = 20  # responses in time before a backoff is halved
+min_can_timeout = 0x05
+
+
+class Latency_tracker:
+    '''Recent response latencies per ECU send id, and the AT ST value they allow'''
+
+    def __init__(self):
+        self.samples = {}
+        self.backoffs = {}
+        self.streaks = {}
+
+    def add(self, sendid, latency):
+        if sendid not in self.samples:
+            self.samples[sendid] = deque(maxlen=latency_samples)
+        self.samples[sendid].append(latency)
+        if sendid in self.backoffs:
+            self.streaks[sendid] = self.streaks.get(sendid, 0) + 1
+            if self.streaks[sendid] >= latency_backoff_decay:
+                self.streaks[sendid] = 0
+                self.backoffs[sendid] //= 2
+                if self.backoffs[sendid] <= 1:
+                    del self.backoffs[sendid]
+
+    def reset(self, sendid):
+        self.samples.pop(sendid, None)
+        self.backoffs.pop(sendid, None)
+        self.streaks.pop(sendid, None)
+
+    def backoff(self, sendid):
+        # The timeout was too short, it is doubled until enough responses arrive in time
+        self.backoffs[sendid] = min(self.backoffs.get(sendid, 1) * 2, latency_max_backoff)
+        self.streaks[sendid] = 0
+
+    def percentile(self, sendid):
+        samples = self.samples.get(sendid)
+        if not samples or len(samples) < latency_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(math.ceil(latency_percentile * len(ordered))) - 1]
+
+    def timeout_value(self, sendid):
+        # AT ST value, None until there are enough samples
+        latency = self.percentile(sendid)
+        if latency is None:
+            return None
+        seconds = latency * self.backoffs.get(sendid, 1) + latency_margin
+        return min(max(int(math.ceil(seconds / 0.004)), min_can_timeout), 0xFF)
+
+
+# Pacing: gap kept between the end of an ECU response and the next request
+p3_min = 0.055  # K-line P3 min, ISO 14230
+pacing_step = 0.005  # first gap added when an ECU shows it cannot keep up
+pacing_max_gap = 0.2
+pacing_decay = 20  # good responses before a learned gap is halved
+rate_samples = 20
+overload_errors = ("BUFFER FULL", "CAN ERROR", "RX ERROR")
+
+
+# P2* of ISO 14229, the longest an ECU stays silent once it answered responsePending (s)
+p2_star = 5.0
+
+
+def is_pending_frame(frame):
+    # Single frame carrying NRC 0x78, the ECU needs more time to answer
+    return frame[:4] == "037F" and frame[6:8] == "78"
+
+
+def is_busy_response(response):
+    for line in response.split('\n'):
+        frame = line.strip().replace(' ', '').upper()
+        if frame.startswith("037F"):  # raw CAN single frame
+            frame = frame[2:]
+        if frame.startswith("7F") and frame[4:6] == "21":
+            return True
+    return False
+
+
+class Pacer:
+    '''Gap to keep before the next request, learned per ECU, and the request rate achieved'''
+
+    def __init__(self):
+        self.gaps = {}
+        self.streaks = {}
+        self.last_response = 0
+        self.times = deque(maxlen=rate_samples)
+
+    def wait(self, ecu, protocol, service_delay):
+        floor = p3_min if protocol == "iso" else 0.
+        gap = max(floor, self.gaps.get(ecu, 0.), service_delay)
+        remaining = gap - (time.time() - self.last_response)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def update(self, ecu, response):
+        self.last_response = time.time()
+        self.times.append(self.last_response)
+        # busyRepeatRequest, or the adapter overflowing, means the requests come too fast
+        if is_busy_response(response) or any(e in response for e in overload_errors):
+            self.gaps[ecu] = min(max(self.gaps.get(ecu, 0.) * 2, pacing_step), pacing_max_gap)
+            self.streaks[ecu] = 0
+        elif ecu in self.gaps:
+            self.streaks[ecu] = self.streaks.get(ecu, 0) + 1
+            if self.streaks[ecu] >= pacing_decay:
+                self.streaks[ecu] = 0
+                self.gaps[ecu] /= 2
+                if self.gaps[ecu] < pacing_step:
+                    del self.gaps[ecu]
+
+    def request_rate(self):
+        # Requests per second over the last rate_samples requests
+        if len(self.times) < 2:
+            return 0.
+        span = self.times[-1] - self.times[0]
+        if span <= 0:
+            return 0.
+        return (len(self.times) - 1) / span
+
+
+# Tester present, sent from a thread when the bus stayed idle that long (s)
+tester_present_interval = 1.5
+# Same requests with the positive response suppressed (UDS bit 7, KWP responseRequired=no)
+tester_present_suppressed = {"3E": "3E80", "3E00": "3E80", "3E01": "3E02"}
+
+
+class Tester_present(threading.Thread):
+    '''Keeps the diagnostic session open while the bus is idle, see ELM.set_tester_present'''
+
+    def __init__(self, device, command, interval=tester_present_interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.device = device
+        self.command = command
+        self.interval = interval
+        self.started = time.time()
+        self.stop_event = threading.Event()
+
+    def idle(self):
+        return time.time() - max(self.device.lastCMDtime, self.started)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval / 4):
+            if self.idle() < self.interval:
+                continue
+            # Never between the frames of an exchange, and the bus goes back to the UI first
+            if not self.device.lock.acquire(timeout=self.interval / 4):
+                continue
+            try:
+                if not self.stop_event.is_set() and self.idle() >= self.interval:
+                    self.device.send_tester_present(self.command)
+            except (OSError, AttributeError) as e:
+                print("Tester present stopped: " + str(e))
+                break
+            finally:
+                self.device.lock.release()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# Frame count of the ECU responses, appended to single frame requests so that the ELM
+# returns as soon as the last frame arrived instead of waiting for its timeout
+frame_hints_file = "ddt4all_data/frame_hints.json"
+frame_hints_version = 1
+frame_hints_save_delay = 30  # s between two writes of changed hints
+read_services = ("21", "22")  # they can be sent again safely
+
+
+class Frame_hints:
+    '''Frame counts per ECU send id and request, kept on disk across sessions'''
+
+    def __init__(self, filename=frame_hints_file):
+        self.filename = filename
+        self.hints = {}
+        self.dirty = False
+        self.saved = time.time()
+        self.load()
+        # Changes are written at most every frame_hints_save_delay, and when the program exits
+        atexit.register(self.save)
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "r", encoding="UTF-8") as f:
+                content = json.loads(f.read())
+            if content["version"] == frame_hints_version:
+                self.hints = content["hints"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(_("Cannot read frame count hints"), e)
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        self.saved = time.time()
+        try:
+            with open(self.filename + ".tmp", "w", encoding="UTF-8") as f:
+                f.write(json.dumps({"version": frame_hints_version, "hints": self.hints}))
+            os.replace(self.filename + ".tmp", self.filename)
+        except OSError as e:
+            print(_("Cannot write frame count hints"), e)
+
+    def get(self, sendid, request):
+        return self.hints.get(sendid, {}).get(request)
+
+    def set(self, sendid, request, nframes):
+        if self.get(sendid, request) == nframes:
+            return
+        self.hints.setdefault(sendid, {})[request] = nframes
+        self.changed()
+
+    def discard(self, sendid, request):
+        ecu_hints = self.hints.get(sendid)
+        if ecu_hints and request in ecu_hints:
+            del ecu_hints[request]
+            self.changed()
+
+    def changed(self):
+        self.dirty = True
+        if time.time() - self.saved >= frame_hints_save_delay:
+            self.save()
+
+
+# Adapter settings that ELM.cmd does not send again while the adapter already has them,
+# longest names first. Single letter settings only take 0 or 1 (ATS0, but not ATSI).
+at_settings = ("FCSH", "FCSD", "FCSM", "CAF", "CFC", "CRA", "IIA", "SH", "SP", "ST", "SW", "WM", "IB", "CP", "KW",
+               "AT", "E", "S", "H", "L", "D", "R")
+# AT commands that leave the settings alone, any other unknown AT command forgets them all
+at_actions = ("I", "@1", "SI", "FI", "PC", "MA", "RV", "DP", "DPN", "BD", "CS", "IGN", "RD")
+at_resets = ("Z", "WS", "D")
+
+
+def get_at_setting(command):
+    '''Returns (setting, value) for an adapter setting command, "reset" for a reset,
+       "unknown" for an unknown AT command and None for anything else'''
+    c = command.upper().replace(" ", "")
+    if c.startswith("STPBR"):
+        return "STPBR", c[5:]
+    if c.startswith("STP"):
+        # STN protocol, shares the slot of ATSP
+        return "SP", c
+    if not c.startswith("AT"):
+        return None
+    c = c[2:]
+    if c in at_resets:
+        return "reset"
+    if c in ("AL", "NL"):
+        return "AL", c
+    for setting in at_settings:
+        if c.startswith(setting):
+            value = c[len(setting):]
+            if len(setting) == 1 and value not in ("0", "1"):
+                continue
+            if setting == "SP":
+                value = "ATSP" + value
+            return setting, value
+    if c in at_actions:
+        return None
+    return "unknown"
+
+
 class ELM:
     '''ELM327 class'''
 
@@ -857,8 +1306,17 @@ class ELM:
     lastinitrsp = ""
     adapter_type = "STD"  # ELM adapter type: STD, OBDLINK, etc.
 
-    rsp_cache = {}
-    l1_cache = {}
+    rsp_cache = {}  # (address, request) -> (expiry time or None, response)
+    calibration_reads = {}  # address -> reads of data the ECU has a write request for
+    l1_cache = None  # Frame_hints
+    latency = None  # Latency_tracker
+    pacer = None  # Pacer
+    can_timeout = 0  # ms set by set_can_timeout over options.cantimeout, 0 to follow the option
+    last_pending = 0  # s the ECU stayed pending on the last request
+    lock = None  # held by a command exchange, see Tester_present
+    tester_present = None  # Tester_present
+    suppress_support = {}  # address -> whether the ECU stays silent on the suppressed tester present
+    currentsendid = ""  # CAN id the requests are sent to
 
     ATR1 = True
     ATCFC0 = False
@@ -867,11 +1325,23 @@ class ELM:
 
     lastMessage = ""
     monitorstop = False
+    monitoring = False  # AT MA running, the tester present thread stays off the bus
 
     connectionStatus = False
 
     def __init__(self, portName, rate, adapter_type, maxspeed="No"):
         self.adapter_type = adapter_type
+        self.l1_cache = Frame_hints()
+        self.latency = Latency_tracker()
+        self.pacer = Pacer()
+        self.lock = threading.RLock()
+        self.suppress_support = {}
+        self.rsp_cache = {}
+        self.calibration_reads = {}
+        # Shadow of the adapter settings, setting -> (value, response)
+        self.at_state = {}
+        self.at_connection = None
+        self.at_skipped = 0
         options.port_speed = rate
         for speed in [int(rate), 38400, 115200, 230400, 57600, 9600, 500000, 1000000, 2000000]:
             print(_("Trying to open port ") + "%s @ %i" % (portName, speed))
@@ -1045,6 +1515,9 @@ class ELM:
             raise
 
     def __del__(self):
+        if self.l1_cache is not None:
+            self.l1_cache.save()
+        self.set_tester_present("")
         try:
             if _ is not None:
                 print(_("ELM reset..."))
@@ -1062,16 +1535,45 @@ class ELM:
         '''
         self.rsp_cache = {}
 
+    def set_calibration_reads(self, reads):
+        ''' Reads of the current ECU that only change through one of
+            its write requests, see Ecu_file.get_calibration_reads
+        '''
+        self.calibration_reads[self.currentaddress] = set(reads)
+
+    def get_cache_ttl(self, request):
+        if request.startswith(identification_requests):
+            return cache_ttl["identification"]
+        if request in self.calibration_reads.get(self.currentaddress, ()):
+            return cache_ttl["calibration"]
+        return cache_ttl["live"]
+
+    def invalidate_cache(self, request):
+        # Drops what the request can change, for the current ECU
+        service = request[:2]
+        if service in write_services:
+            read_service, length = write_services[service]
+            self.rsp_cache.pop((self.currentaddress, read_service + request[2:2 + length]), None)
+        elif service in cache_reset_services:
+            for key in [k for k in self.rsp_cache if k[0] == self.currentaddress]:
+                del self.rsp_cache[key]
+
     def request(self, req, positive='', cache=True, serviceDelay="0"):
         ''' Check if request is saved in L2 cache.
             If not then
               - make real request
               - convert responce to one line
-              - save in L2 cache
+              - save in L2 cache, for as long as get_cache_ttl allows
             returns response without consistency check
         '''
-        if cache and req in self.rsp_cache.keys():
-            return self.rsp_cache[req]
+        key = (self.currentaddress, req.replace(' ', '').upper())
+        if cache and key in self.rsp_cache:
+            expiry, rsp = self.rsp_cache[key]
+            if expiry is None or expiry > time.time():
+                return rsp
+            del self.rsp_cache[key]
+
+        self.invalidate_cache(key[1])
 
         # send cmd
         rsp = self.cmd(req, serviceDelay)
@@ -1096,19 +1598,21 @@ class ELM:
 
         rsp = res
 
-        # populate L2 cache
-        self.rsp_cache[req] = rsp
+        # populate L2 cache, with positive responses only
+        ttl = self.get_cache_ttl(key[1])
+        if ttl != 0 and self.is_positive(key[1], rsp):
+            self.rsp_cache[key] = (None if ttl is None else time.time() + ttl, rsp)
 
         # save log
 
         if self.vf != 0:
             tmstr = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-            if self.currentaddress in dnat_ext and len(self.currentaddress) == 8:
-                self.vf.write(tmstr + ";" + "0x" + dnat_ext[
+            if self.currentaddress in addressing.dnat_ext and len(self.currentaddress) == 8:
+                self.vf.write(tmstr + ";" + "0x" + addressing.dnat_ext[
                     self.currentaddress] + ";" + "0x" + req + ";" + "0x" + rsp.rstrip().replace(" ",
                                                                                                 ",0x") + ";" + "\n")
-            elif self.currentaddress in dnat:
-                self.vf.write(tmstr + ";" + "0x" + dnat[
+            elif self.currentaddress in addressing.dnat:
+                self.vf.write(tmstr + ";" + "0x" + addressing.dnat[
                     self.currentaddress] + ";" + "0x" + req + ";" + "0x" + rsp.rstrip().replace(" ",
                                                                                                 ",0x") + ";" + "\n")
             else:
@@ -1117,6 +1621,21 @@ class ELM:
 
         return rsp
 
+    @staticmethod
+    def is_positive(request, rsp):
+        try:
+            return int(rsp[:2], 16) == int(request[:2], 16) + 0x40
+        except ValueError:
+            return False
+
+    def request_bytes(self, req, positive='', cache=True, serviceDelay="0"):
+        ''' Same as request, but returns a Response object
+            with the payload as bytes and the response status
+        '''
+        if isinstance(req, (bytes, bytearray)):
+            req = req.hex().upper()
+        return parse_response(self.request(req, positive, cache, serviceDelay))
+
     def errorval(self, val):
         if val not in negrsp:
             return "not registered error"
@@ -1124,15 +1643,22 @@ class ELM:
             return negrsp[val]
 
     def cmd(self, command, serviceDelay="0"):
-        tb = time.time()  # start time
+        # The tester present thread must not come between the frames of an exchange
+        with self.lock:
+            return self.locked_cmd(command, serviceDelay)
+
+    def locked_cmd(self, command, serviceDelay="0"):
+        # Adapter settings it already has are not sent again
+        shadowed = self.get_shadowed_response(command)
+        if shadowed is not None:
+            return shadowed
 
-        # Ensure time gap between commands
-        dl = self.busLoad + self.srvsDelay - tb + self.lastCMDtime
-        if ((tb - self.lastCMDtime) < (self.busLoad + self.srvsDelay)) \
-                and ("AT" not in command.upper() or "ST" not in command.upper()):
-            time.sleep(self.busLoad + self.srvsDelay - tb + self.lastCMDtime)
+        # Ensure the time gap the protocol and the ECU need, adapter commands are not paced
+        adapter_command = "AT" in command.upper() or "ST" in command.upper()
+        if not adapter_command:
+            self.pacer.wait(self.currentaddress, self.currentprotocol, self.busLoad + self.srvsDelay)
 
-        tb = time.time()  # renew start time
+        tb = time.time()  # start time
 
         # If we use wifi and there was more than keepAlive seconds of silence then reinit tcp
         if (tb - self.lastCMDtime) > self.keepAlive:
@@ -1158,6 +1684,8 @@ class ELM:
         # send command
         cmdrsp = self.send_cmd(command)
         self.lastCMDtime = tc = time.time()
+        if not adapter_command:
+            self.pacer.update(self.currentaddress, cmdrsp + "\n" + self.buff)
 
         # add srvsDelay to time gap before send next command
         self.srvsDelay = float(serviceDelay) / 1000.
@@ -1172,21 +1700,82 @@ class ELM:
                     self.lf.flush()
         return cmdrsp
 
+    def get_shadowed_response(self, command):
+        # Response the adapter gave when it got this setting, None if it must be sent
+        if options.simulation_mode or self.port.connection_id != self.at_connection:
+            return None
+        setting = get_at_setting(command)
+        if not isinstance(setting, tuple) or setting[0] not in self.at_state:
+            return None
+        value, response = self.at_state[setting[0]]
+        if value != setting[1]:
+            return None
+        self.at_skipped += 1
+        if self.lf != 0:
+            tmstr = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+            self.lf.write("#[" + tmstr + "]" + "Already set: " + command + "\n")
+            self.lf.flush()
+        return response
+
+    def update_adapter_state(self, command, response):
+        # Called with every command sent, keeps at_state in line with the adapter
+        if options.simulation_mode:
+            return
+        if self.port.connection_id != self.at_connection:
+            self.at_state = {}
+            self.at_connection = self.port.connection_id
+        setting = get_at_setting(command)
+        failed = "TIMEOUT" in response or not self.port.connectionStatus
+        if setting is not None:
+            failed = failed or "?" in response or "ERROR" in response
+        if failed or setting in ("reset", "unknown") or "LV RESET" in response:
+            self.at_state = {}
+        elif setting is not None:
+            if setting[0] == "SP":
+                self.at_state.pop("STPBR", None)
+            self.at_state[setting[0]] = (setting[1], response)
+
     def set_can_timeout(self, value):
+        # Only a value other than options.cantimeout is kept, so going back to AUTO resumes the adaptation
+        self.can_timeout = 0 if value == options.cantimeout else value
         val = value // 4
         if val > 255:
             val = 255
         val = hex(val)[2:].upper().zfill(2)
         self.cmd("AT ST %s" % val)
 
+    def get_adaptive_timeout(self, command):
+        # AT ST value for command, None if there is no adaptive timeout for it
+        if self.can_timeout > 0 or options.cantimeout > 0 or not self.currentsendid:
+            return None
+        if command[:2] not in read_services:
+            return None
+        return self.latency.timeout_value(self.currentsendid)
+
+    def update_can_timeout(self, command):
+        '''Sets the adaptive timeout for reads, the ELM default for anything else.
+           Returns True if the adaptive timeout is used.
+        '''
+        if self.can_timeout > 0 or options.cantimeout > 0:
+            return False
+        value = self.get_adaptive_timeout(command)
+        st = "AT ST %02X" % (default_can_timeout if value is None else value)
+        if self.get_shadowed_response(st) is None:
+            self.send_raw(st)
+        return value is not None
+
     def send_cmd(self, command):
         if "AT" in command.upper() or "ST" in command.upper() or self.currentprotocol != "can":
             return self.send_raw(command)
-        if self.ATCFC0:
-            return self.send_can_cfc0(command)
-        else:
-            rsp = self.send_can(command)
-            return rsp
+        adaptive = self.update_can_timeout(command)
+        send = self.send_can_cfc0 if self.ATCFC0 else self.send_can
+        rsp = send(command)
+        if adaptive and rsp == "" and "NO DATA" in self.buff and command not in tester_present_suppressed.values():
+            # The adaptive timeout was too short, wait longer and ask again
+            self.latency.backoff(self.currentsendid)
+            self.update_can_timeout(command)
+            rsp = send(command)
+        return rsp
 
     def send_can(self, command):
         command = command.strip().replace(' ', '')
@@ -1199,10 +1788,15 @@ class ELM:
         # do framing
         raw_command = []
         cmd_len = int(len(command) / 2)
+        hint = None
+        use_hints = (not options.opt_n1c and not options.simulation_mode and self.currentsendid
+                     and command[:2] in read_services)
         if cmd_len < 8:  # single frame
             # check L1 cache here
-            if command in self.l1_cache.keys():
-                raw_command.append(("%0.2X" % cmd_len) + command + self.l1_cache[command])
+            if use_hints:
+                hint = self.l1_cache.get(self.currentsendid, command)
+            if hint is not None:
+                raw_command.append(("%0.2X" % cmd_len) + command + "%X" % hint)
             else:
                 raw_command.append(("%0.2X" % cmd_len) + command)
         else:
@@ -1217,6 +1811,7 @@ class ELM:
                 command = command[14:]
 
         responses = []
+        sent = time.time()
 
         # send frames
         for f in raw_command:
@@ -1234,9 +1829,13 @@ class ELM:
                         continue
                     responses.append(s)
 
+        responses = self.get_final_responses(responses, sent, True)
+
         # analyse response (2 phases)
         result = ""
         noerrors = True
+        complete = True  # all the frames arrived in order
+        nreceived = len(responses)
         cframe = 0  # frame counter
         nbytes = 0  # number bytes in response
         nframes = 0
@@ -1244,9 +1843,6 @@ class ELM:
         if len(responses) == 0:  # no data in response
             return ""
 
-        if len(responses) > 1 and responses[0].startswith('037F') and responses[0][6:8] == '78':
-            responses = responses[1:]
-
         if len(responses) == 1:  # single frame response
             if responses[0][:1] == '0':
                 nbytes = int(responses[0][1:2], 16)
@@ -1254,29 +1850,29 @@ class ELM:
                 result = responses[0][2:2 + nbytes * 2]
             else:  # wrong response (not all frames received)
                 self.error_frame += 1
-                noerrors = False
+                noerrors = complete = False
         else:  # multi frame response
             if responses[0][:1] == '1':  # first frame
                 nbytes = int(responses[0][1:4], 16)
-                nframes = nbytes / 7 + 1
+                nframes = nbytes // 7 + 1
                 cframe = 1
                 result = responses[0][4:16]
             else:  # wrong response (first frame omitted)
                 self.error_frame += 1
-                noerrors = False
+                noerrors = complete = False
 
             for fr in responses[1:]:
                 if fr[:1] == '2':  # consecutive frames
                     tmp_fn = int(fr[1:2], 16)
                     if tmp_fn != (cframe % 16):  # wrong response (frame lost)
                         self.error_frame += 1
-                        noerrors = False
+                        noerrors = complete = False
                         continue
                     cframe += 1
                     result += fr[2:16]
                 else:  # wrong response
                     self.error_frame += 1
-                    noerrors = False
+                    noerrors = complete = False
 
         errorstr = "Unknown"
         # check for negative response (repeat the same as in cmd())
@@ -1286,17 +1882,28 @@ class ELM:
                 errorstr = negrsp[result[4:6]]
             if self.vf != 0:
                 tmstr = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-                if self.currentaddress in dnat_ext and len(self.currentaddress) == 8:
-                    self.vf.write(tmstr + ";" + dnat_ext[
+                if self.currentaddress in addressing.dnat_ext and len(self.currentaddress) == 8:
+                    self.vf.write(tmstr + ";" + addressing.dnat_ext[
                         self.currentaddress] + ";" + "0x" + command + ";" + result + ";" + errorstr + "\n")
-                elif self.currentaddress in dnat:
-                    self.vf.write(tmstr + ";" + dnat[
+                elif self.currentaddress in addressing.dnat:
+                    self.vf.write(tmstr + ";" + addressing.dnat[
                         self.currentaddress] + ";" + "0x" + command + ";" + result + ";" + errorstr + "\n")
                 self.vf.flush()
 
+        if len(result) / 2 < nbytes:
+            complete = False
+
+        # A hint not matching the response is dropped, and the request sent again
+        # without it if the ELM stopped reading too early
+        pending = result[:2] == '7F' and result[4:6] == '78'
+        if hint is not None and (nreceived != hint or not complete or pending):
+            self.l1_cache.discard(self.currentsendid, command)
+            if not complete or pending:
+                return self.send_can(command)
+
         # populate L1 cache
-        if noerrors and nframes < 16 and command[:1] == '2' and not options.opt_n1c:
-            self.l1_cache[command] = str(nframes)
+        if use_hints and hint is None and noerrors and complete and nreceived == nframes and 0 < nframes < 16:
+            self.l1_cache.set(self.currentsendid, command, nframes)
 
         if len(result) / 2 >= nbytes and noerrors:
             # Remove unnecessary bytes
@@ -1314,6 +1921,7 @@ class ELM:
             return "ODD ERROR"
         if not all(c in string.hexdigits for c in command):
             return "HEX ERROR"
+        service = command[:2]
 
         # do framing
         raw_command = []
@@ -1333,6 +1941,8 @@ class ELM:
 
         responses = []
 
+        sent = time.time()
+
         # send frames
         BS = 1  # Burst Size
         ST = 0  # Frame Interval
@@ -1343,8 +1953,9 @@ class ELM:
             if options.cantimeout > 0:
                 self.set_can_timeout(options.cantimeout)
             else:
-                # set elm timeout to 300ms for first response
-                self.send_raw('AT ST 4B')
+                # set elm timeout for first response, 300ms until the ECU latency is known
+                adaptive = self.get_adaptive_timeout(service)
+                self.send_raw('AT ST %02X' % (0x4B if adaptive is None else adaptive))
 
         while Fc < Fn:
             # enable responses
@@ -1417,6 +2028,7 @@ class ELM:
                 Fc += 1
 
         # now we are going to receive data. st or ff should be in responses[0]
+        responses = self.get_final_responses(responses, sent, False)
         if len(responses) != 1:
             return "WRONG RESPONSE MULTILINE CFC0"
 
@@ -1483,6 +2095,56 @@ class ELM:
         else:
             return "WRONG RESPONSE CFC0 " + errorstr
 
+    def get_final_responses(self, responses, sent, flow_control):
+        ''' Responses without the responsePending (NRC 0x78) frames. When the ELM
+            gave up before the final response came, it is read from the bus.
+            With flow_control, the rest of a multi frame response is requested.
+        '''
+        final = [r for r in responses if not is_pending_frame(r)]
+        if len(final) == len(responses):
+            return responses
+        if not final and not options.simulation_mode:
+            final = self.listen_final_response(flow_control)
+
+        self.last_pending = time.time() - sent
+        print("ECU response pending for %.2f s" % self.last_pending)
+        if self.lf != 0:
+            tmstr = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+            self.lf.write("#[" + tmstr + "]" + "Response pending %.3f s\n" % self.last_pending)
+            self.lf.flush()
+        # Without the final response, the pending one is reported
+        return final or responses[-1:]
+
+    def listen_final_response(self, flow_control):
+        # Each pending frame the ECU sends again gives it another p2_star
+        frames = []
+        deadline = time.time() + p2_star
+        self.port.write("AT MA\r".encode('utf-8'))
+        while time.time() < deadline:
+            data, found = self.port.read_until(b'\r', deadline - time.time())
+            line = data.decode('latin1').strip().replace(' ', '')
+            if '>' in line:
+                break
+            if len(line) == 0 or not all(c in string.hexdigits for c in line):
+                continue
+            if is_pending_frame(line):
+                deadline = time.time() + p2_star
+                continue
+            if line[:1] in ('0', '1'):  # single frame or first frame
+                frames.append(line)
+                break
+
+        self.port.write("AT\r".encode('utf-8'))
+        self.port.expect('>')
+
+        if flow_control and frames and frames[0][:1] == '1':
+            # The ELM does not send the flow control while monitoring
+            for s in self.send_raw("300000").split('\n'):
+                s = s.strip().replace(' ', '')
+                if s[:1] == '2' and all(c in string.hexdigits for c in s):
+                    frames.append(s)
+        return frames
+
     def send_raw(self, command, expect='>'):
         tb = time.time()  # start time
 
@@ -1494,6 +2156,7 @@ class ELM:
             self.lf.flush()
 
         # send command
+        sent = time.time()
         if not options.simulation_mode:
             self.port.write(str(command + "\r").encode("utf-8"))  # send command
 
@@ -1530,6 +2193,10 @@ class ELM:
         if "CAN ERROR" in self.buff:
             self.error_can += 1
 
+        self.update_adapter_state(command, self.buff)
+        if self.currentprotocol == "can" and self.currentsendid and not options.simulation_mode:
+            self.record_latency(command, sent)
+
         self.response_time = ((self.response_time * 9) + (tc - tb)) / 10
 
         # save response to log
@@ -1539,11 +2206,67 @@ class ELM:
 
         return self.buff
 
+    def record_latency(self, command, sent):
+        # Time from sending the frame to the first byte of the ECU response
+        if "AT" in command.upper() or "ST" in command.upper():
+            return
+        echo_end = self.buff.find('\n')
+        if echo_end < 0:
+            return
+        for line in self.buff[echo_end + 1:].split('\n'):
+            frame = line.strip().replace(' ', '')
+            if not frame:
+                continue
+            if not all(c in string.hexdigits for c in frame):
+                return
+            arrival = self.port.arrival_time(self.buff.index(line, echo_end + 1))
+            if arrival is not None:
+                self.latency.add(self.currentsendid, arrival - sent)
+            return
+
+    def request_rate(self):
+        return self.pacer.request_rate()
+
+    def set_tester_present(self, command):
+        ''' Sends command from a background thread whenever the bus stayed
+            idle for tester_present_interval, an empty command stops it
+        '''
+        if self.tester_present is not None:
+            self.tester_present.stop()
+            self.tester_present = None
+        if command and not options.simulation_mode:
+            self.tester_present = Tester_present(self, command.replace(' ', '').upper())
+            self.tester_present.start()
+
+    def send_tester_present(self, command):
+        if self.monitoring:
+            return ""
+        suppressed = tester_present_suppressed.get(command)
+        supported = self.suppress_support.get(self.currentaddress)
+        if suppressed is None or supported is False or self.currentprotocol != "can":
+            return self.cmd(command)
+        if supported is None:
+            # Whether the ECU honours the suppression is only known from its silence
+            rsp = self.cmd(suppressed)
+            self.suppress_support[self.currentaddress] = rsp == "" and "NO DATA" in self.buff
+            if not self.suppress_support[self.currentaddress]:
+                return self.cmd(command)
+            return rsp
+        # No answer to wait for, the ELM returns as soon as the frame is sent
+        self.cmd("AT R0")
+        self.send_raw("%02X" % (len(suppressed) // 2) + suppressed)
+        self.cmd("AT R1")
+        self.ATR1 = True
+        self.lastCMDtime = time.time()
+        return ""
+
     def close_protocol(self):
         self.cmd("atpc")
 
     def start_session_can(self, start_session):
         self.startSession = start_session
+        # The ECU may answer at another pace in the new session
+        self.latency.reset(self.currentsendid)
         retcode = self.cmd(self.startSession)
         if retcode.startswith('50'):
             return True
@@ -1572,10 +2295,17 @@ class ELM:
         if options.simulation_mode:
             pass
         else:
-            self.port.write("AT MA\r".encode('utf-8'))
+            # Only the start and the stop are locked, a command from the UI still aborts AT MA
+            with self.lock:
+                self.monitoring = True
+                self.port.write("AT MA\r".encode('utf-8'))
             stream = ""
             while not self.monitorstop:
                 byte = self.port.read()
+                if byte == "":
+                    # monitorstop is still checked every 100 ms
+                    self.port.wait_readable(0.1)
+                    continue
                 if byte == '\r' or byte == '<' or byte == '\n':
                     if stream == "AT MA" or stream == "DATA ERROR":
                         # Prefiltering echo and error reports (if any)
@@ -1590,15 +2320,17 @@ class ELM:
                 if byte:
                     stream += byte
 
-            self.port.write("AT\r".encode('utf-8'))
-            self.port.expect('>')
+            with self.lock:
+                self.port.write("AT\r".encode('utf-8'))
+                self.port.expect('>')
+                self.monitoring = False
 
     def init_can(self):
         self.currentprotocol = "can"
         self.currentaddress = ""
+        self.currentsendid = ""
         self.startSession = ""
         self.lastCMDtime = 0
-        self.l1_cache = {}
 
         if self.lf != 0:
             tmstr = datetime.now().strftime("%x %H:%M:%S.%f")[:-3]
@@ -1631,7 +2363,6 @@ class ELM:
         self.currentaddress = addr
         self.startSession = ""
         self.lastCMDtime = 0
-        self.l1_cache = {}
         self.canline = canline
 
         if 'idTx' in ecu and 'idRx' in ecu:
@@ -1649,6 +2380,8 @@ class ELM:
         else:
             return
 
+        self.currentsendid = TXa
+
         extended_can = False
         if len(RXa) == 8:
             # Extended (29bits) addressing
@@ -1838,6 +2571,7 @@ def elm_checker(port, speed, adapter, logview, app):
                 logview.append(_("Warning: No ELS27 response detected"))
                 logview.append(_("Will attempt connection anyway..."))
         
+        release_elm()
         options.elm = ELM(port, speed, adapter)
 
         if options.elm_failed:
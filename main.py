@@ -8,6 +8,7 @@ import locale
 import os
 import sys
 import tempfile
+import time
 from importlib.machinery import SourceFileLoader
 
 import PyQt5.QtCore as core
@@ -42,13 +43,9 @@ if sys.platform[:3] == "lin":
 
 def load_this():
     try:
-        with open("ddt4all_data/projects.json", "r", encoding="UTF-8") as f:
-            vehicles_loc = json.loads(f.read())
-        ecu.addressing = vehicles_loc["projects"]["All"]["addressing"]
-        elm.snat = vehicles_loc["projects"]["All"]["snat"]
-        elm.snat_ext = vehicles_loc["projects"]["All"]["snat_ext"]
-        elm.dnat = vehicles_loc["projects"]["All"]["dnat"]
-        elm.dnat_ext = vehicles_loc["projects"]["All"]["dnat_ext"]
+        # Projects are decoded on demand, see ecu.Vehicle_projects
+        vehicles_loc = ecu.Vehicle_projects()
+        elm.addressing.load(vehicles_loc.project("All"))
         return vehicles_loc
     except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
         print(_("ddt4all_data/projects.json not found or not ok.") + f" Error: {e}")
@@ -106,6 +103,248 @@ class Ecu_finder(widgets.QDialog):
         self.ecuscanner.identify_from_frame(addr, frame)
 
 
+class Ecu_list_group:
+    def __init__(self, name, tooltip):
+        self.name = name
+        self.tooltip = tooltip
+        # Database target positions and custom rows, turned into rows when first needed
+        self.positions = []
+        self.custom_rows = []
+        self.rows = None
+        # project -> bitmap of the rows using it
+        self.projects = {}
+        # Row numbers in sort order, and the ones the filter shows
+        self.order = []
+        self.shown = []
+
+    def build(self, database):
+        self.rows = list(self.custom_rows)
+        seen = set((r[0], r[1]) for r in self.rows)
+        targets = database.targets
+        for position in self.positions:
+            target = targets[position]
+            if (target.name, target.addr) in seen:
+                continue
+            seen.add((target.name, target.addr))
+            self.rows.append([target.name, target.addr, target.protocol, target.supplier, target.diagversion,
+                              target.soft, target.version, "/".join(target.projects)])
+
+        projects = {}
+        for i, row in enumerate(self.rows):
+            if len(row) > 7:
+                for project in row[7].upper().split("/"):
+                    projects.setdefault(project, []).append(i)
+        self.projects = {project: make_bitmap(rows, len(self.rows)) for project, rows in projects.items()}
+
+    def sort(self, column, order):
+        def key(i):
+            row = self.rows[i]
+            return row[column] if column < len(row) else ""
+
+        self.order = sorted(range(len(self.rows)), key=key, reverse=order == core.Qt.DescendingOrder)
+
+    def filter(self, project, search):
+        if project == "ALL":
+            bitmap = make_bitmap(range(len(self.rows)), len(self.rows))
+        else:
+            bitmap = self.projects.get(project.upper(), bytes(len(self.rows) // 8 + 1))
+        if search:
+            search = search.lower()
+            names = make_bitmap([i for i, row in enumerate(self.rows) if search in row[0].lower()], len(self.rows))
+            bitmap = bytes(a & b for a, b in zip(bitmap, names))
+        self.shown = [i for i in self.order if bitmap[i >> 3] & (1 << (i & 7))]
+
+
+def make_bitmap(rows, count):
+    bitmap = bytearray(count // 8 + 1)
+    for i in rows:
+        bitmap[i >> 3] |= 1 << (i & 7)
+    return bytes(bitmap)
+
+
+class Ecu_list_model(core.QAbstractItemModel):
+    '''ECU database tree of Ecu_list
+       Groups rows are built when the group is first shown, or when a filter needs them
+    '''
+
+    def __init__(self, parent=None):
+        super(Ecu_list_model, self).__init__(parent)
+        self.headers = [_('ECU name'), _('ID'), _('Protocol'), _('Supplier'), _('Diag'), _('Soft'), _('Version'),
+                        _('Projets')]
+        self.database = None
+        self.groups = []
+        # Groups numbers of the top level rows, and the reverse
+        self.visible = []
+        self.visible_rows = {}
+        self.project = "ALL"
+        self.search = ""
+        self.sort_column = 0
+        self.sort_order = core.Qt.AscendingOrder
+
+    def init(self, database, custom_rows):
+        self.beginResetModel()
+        self.database = database
+        groups = {"Custom": Ecu_list_group("Custom", "")}
+        groups["Custom"].custom_rows = custom_rows
+        longgroupnames = {}
+        for addr in sorted(database.targets.values("db_addr")):
+            if addr in database.addr_group_mapping:
+                grp = database.addr_group_mapping[addr]
+                if addr in database.addr_group_mapping_long:
+                    longgroupnames[grp] = database.addr_group_mapping_long[addr]
+            else:
+                grp = "?"
+            if grp not in groups:
+                groups[grp] = Ecu_list_group(grp, "")
+            groups[grp].positions += database.targets.positions("db_addr", addr)
+
+        keys = list(groups.keys())
+        try:
+            keys.sort(key=locale.strxfrm)
+        except (locale.Error, AttributeError):
+            keys.sort()
+        self.groups = []
+        for e in keys:
+            group = groups[e]
+            group.positions.sort()
+            if e in longgroupnames:
+                group.tooltip = longgroupnames[e]
+            elif e in database.addr_group_mapping:
+                group.tooltip = database.addr_group_mapping[e]
+            self.groups.append(group)
+        self.update_filter()
+        self.endResetModel()
+
+    def filtered(self):
+        return self.project != "ALL" or self.search != ""
+
+    def build_group(self, group):
+        group.build(self.database)
+        group.sort(self.sort_column, self.sort_order)
+        group.filter(self.project, self.search)
+
+    def update_filter(self):
+        self.visible = []
+        for i, group in enumerate(self.groups):
+            if group.rows is None:
+                if not self.filtered():
+                    self.visible.append(i)
+                    continue
+                self.build_group(group)
+            else:
+                group.filter(self.project, self.search)
+            if group.shown:
+                self.visible.append(i)
+        if self.sort_column == 0 and self.sort_order == core.Qt.DescendingOrder:
+            self.visible.reverse()
+        self.visible_rows = {g: row for row, g in enumerate(self.visible)}
+
+    def update_layout(self, update):
+        # Keeps the selection and the expanded groups across sorting and filtering
+        self.layoutAboutToBeChanged.emit()
+        old = self.persistentIndexList()
+        keys = []
+        for index in old:
+            if index.internalId() == 0:
+                keys.append((self.visible[index.row()], None, index.column()))
+            else:
+                group = index.internalId() - 1
+                keys.append((group, self.groups[group].shown[index.row()], index.column()))
+        update()
+        new = []
+        shown = {}
+        for group, row, column in keys:
+            if group not in self.visible_rows:
+                new.append(core.QModelIndex())
+            elif row is None:
+                new.append(self.createIndex(self.visible_rows[group], column, 0))
+            else:
+                if group not in shown:
+                    shown[group] = {r: i for i, r in enumerate(self.groups[group].shown)}
+                if row in shown[group]:
+                    new.append(self.createIndex(shown[group][row], column, group + 1))
+                else:
+                    new.append(core.QModelIndex())
+        self.changePersistentIndexList(old, new)
+        self.layoutChanged.emit()
+
+    def set_filter(self, project, search):
+        if (project, search) == (self.project, self.search):
+            return
+        self.project = project
+        self.search = search
+        self.update_layout(self.update_filter)
+
+    def sort(self, column, order=core.Qt.AscendingOrder):
+        def update():
+            self.sort_column = column
+            self.sort_order = order
+            for group in self.groups:
+                if group.rows is not None:
+                    group.sort(column, order)
+            self.update_filter()
+
+        self.update_layout(update)
+
+    def group(self, parent):
+        group = self.groups[self.visible[parent.row()]]
+        if group.rows is None:
+            self.build_group(group)
+        return group
+
+    def index(self, row, column, parent=core.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return core.QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+        return self.createIndex(row, column, self.visible[parent.row()] + 1)
+
+    def parent(self, index=None):
+        if index is None:
+            return super(Ecu_list_model, self).parent()
+        if not index.isValid() or index.internalId() == 0:
+            return core.QModelIndex()
+        return self.createIndex(self.visible_rows[index.internalId() - 1], 0, 0)
+
+    def rowCount(self, parent=core.QModelIndex()):
+        if not parent.isValid():
+            return len(self.visible)
+        if parent.internalId() == 0:
+            return len(self.group(parent).shown)
+        return 0
+
+    def hasChildren(self, parent=core.QModelIndex()):
+        if not parent.isValid():
+            return len(self.visible) > 0
+        return parent.internalId() == 0
+
+    def columnCount(self, parent=core.QModelIndex()):
+        return len(self.headers)
+
+    def data(self, index, role=core.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if index.internalId() == 0:
+            group = self.groups[self.visible[index.row()]]
+            if index.column() == 0:
+                if role == core.Qt.DisplayRole:
+                    return group.name
+                if role == core.Qt.ToolTipRole and group.tooltip:
+                    return group.tooltip
+            return None
+        if role == core.Qt.DisplayRole:
+            group = self.groups[index.internalId() - 1]
+            row = group.rows[group.shown[index.row()]]
+            if index.column() < len(row):
+                return row[index.column()]
+        return None
+
+    def headerData(self, section, orientation, role=core.Qt.DisplayRole):
+        if orientation == core.Qt.Horizontal and role == core.Qt.DisplayRole:
+            return self.headers[section]
+        return None
+
+
 class Ecu_list(widgets.QWidget):
     def __init__(self, ecuscan, treeview_ecu):
         super(Ecu_list, self).__init__()
@@ -115,7 +354,7 @@ class Ecu_list(widgets.QWidget):
 
         self.ecu_map = {}
 
-        for k in vehicles["projects"].keys():
+        for k in vehicles.names():
             self.vehicle_combo.addItem(k)
 
         self.vehicle_combo.activated.connect(self.filterProject)
@@ -128,38 +367,29 @@ class Ecu_list(widgets.QWidget):
         layouth.addWidget(self.vehicle_combo)
         layouth.addWidget(scanbutton)
         layout.addLayout(layouth)
+        self.search = widgets.QLineEdit()
+        self.search.setPlaceholderText(_("Search ECU name"))
+        self.search.setClearButtonEnabled(True)
+        self.search.textChanged.connect(self.searchEcu)
+        layout.addWidget(self.search)
         self.setLayout(layout)
-        self.list = widgets.QTreeWidget(self)
+        self.list = widgets.QTreeView(self)
         self.list.setSelectionMode(widgets.QAbstractItemView.SingleSelection)
+        self.model = Ecu_list_model(self.list)
+        self.list.setModel(self.model)
+        self.list.setSortingEnabled(True)
         layout.addWidget(self.list)
         self.ecuscan = ecuscan
         self.list.doubleClicked.connect(self.ecuSel)
-        self.init()
+        # Filled by init() once the database is loaded
 
     def scanselvehicle(self):
-        project = str(vehicles["projects"][self.vehicle_combo.currentText()]["code"])
-        ecu.addressing = vehicles["projects"][self.vehicle_combo.currentText()]["addressing"]
-        elm.snat = vehicles["projects"][self.vehicle_combo.currentText()]["snat"]
-        elm.snat_ext = vehicles["projects"][self.vehicle_combo.currentText()]["snat_ext"]
-        elm.dnat = vehicles["projects"][self.vehicle_combo.currentText()]["dnat"]
-        elm.dnat_ext = vehicles["projects"][self.vehicle_combo.currentText()]["dnat_ext"]
+        project = vehicles.code(self.vehicle_combo.currentText())
+        elm.addressing.load(vehicles.project(self.vehicle_combo.currentText()))
         self.parent().parent().scan_project(project)
 
     def init(self):
-        self.list.clear()
-        self.list.setSortingEnabled(True)
-        self.list.setColumnCount(8)
-        self.list.model().setHeaderData(0, core.Qt.Horizontal, _('ECU name'))
-        self.list.model().setHeaderData(1, core.Qt.Horizontal, _('ID'))
-        self.list.model().setHeaderData(2, core.Qt.Horizontal, _('Protocol'))
-        self.list.model().setHeaderData(3, core.Qt.Horizontal, _('Supplier'))
-        self.list.model().setHeaderData(4, core.Qt.Horizontal, _('Diag'))
-        self.list.model().setHeaderData(5, core.Qt.Horizontal, _('Soft'))
-        self.list.model().setHeaderData(6, core.Qt.Horizontal, _('Version'))
-        self.list.model().setHeaderData(7, core.Qt.Horizontal, _('Projets'))
-        self.list.sortByColumn(0, core.Qt.AscendingOrder)
-        stored_ecus = {"Custom": []}
-
+        custom_rows = []
         custom_files = glob.glob("./json/*.json.targets")
 
         for cs in custom_files:
@@ -170,91 +400,29 @@ class Ecu_list(widgets.QWidget):
             target = json.loads(jsoncontent)
 
             if not target:
-                grp = "Custom"
                 projects_list = []
                 protocol = ''
             else:
                 target = target[0]
                 protocol = target['protocol']
                 projects_list = target['projects']
-                if target['address'] not in self.ecu_map:
-                    grp = "Custom"
-                else:
-                    grp = self.ecu_map[target['address']]
-
-            if not grp in stored_ecus:
-                stored_ecus[grp] = []
 
             name = "/".join(projects_list)
 
-            stored_ecus[grp].append([cs[:-8][7:], name, protocol])
-
-        longgroupnames = {}
-        for ecu in self.ecuscan.ecu_database.targets:
-            if ecu.addr in self.ecuscan.ecu_database.addr_group_mapping:
-                grp = self.ecuscan.ecu_database.addr_group_mapping[ecu.addr]
-                if ecu.addr in self.ecuscan.ecu_database.addr_group_mapping_long:
-                    longgroupnames[grp] = self.ecuscan.ecu_database.addr_group_mapping_long[ecu.addr]
-            else:
-                grp = "?"
-
-            if not grp in stored_ecus:
-                stored_ecus[grp] = []
-
-            projname = "/".join(ecu.projects)
-
-            soft = ecu.soft
-            version = ecu.version
-            supplier = ecu.supplier
-            diag = ecu.diagversion
-
-            row = [ecu.name, ecu.addr, ecu.protocol, supplier, diag, soft, version, projname]
-            found = False
-            for r in stored_ecus[grp]:
-                if (r[0], r[1]) == (row[0], row[1]):
-                    found = True
-                    break
-            if not found:
-                stored_ecus[grp].append(row)
-
-        keys = list(stored_ecus.keys())
-        try:
-            keys.sort(key=locale.strxfrm)
-        except (locale.Error, AttributeError):
-            keys.sort()
-        for e in keys:
-            item = widgets.QTreeWidgetItem(self.list, [e])
-            if e in longgroupnames:
-                item.setToolTip(0, longgroupnames[e])
-            elif e in self.ecuscan.ecu_database.addr_group_mapping:
-                item.setToolTip(0, self.ecuscan.ecu_database.addr_group_mapping[e])
-            for t in stored_ecus[e]:
-                widgets.QTreeWidgetItem(item, t)
+            custom_rows.append([cs[:-8][7:], name, protocol])
 
+        self.model.init(self.ecuscan.ecu_database, custom_rows)
+        self.list.sortByColumn(0, core.Qt.AscendingOrder)
         self.list.resizeColumnToContents(0)
 
     def filterProject(self):
-        project = str(vehicles["projects"][self.vehicle_combo.currentText()]["code"])
-        ecu.addressing = vehicles["projects"][self.vehicle_combo.currentText()]["addressing"]
-        elm.snat = vehicles["projects"][self.vehicle_combo.currentText()]["snat"]
-        elm.snat_ext = vehicles["projects"][self.vehicle_combo.currentText()]["snat_ext"]
-        elm.dnat = vehicles["projects"][self.vehicle_combo.currentText()]["dnat"]
-        elm.dnat_ext = vehicles["projects"][self.vehicle_combo.currentText()]["dnat_ext"]
-
-        root = self.list.invisibleRootItem()
-        root_items = [root.child(i) for i in range(root.childCount())]
-
-        for root_item in root_items:
-            root_hidden = True
-
-            items = [root_item.child(i) for i in range(root_item.childCount())]
-            for item in items:
-                if (project.upper() in str(item.text(7)).upper().split("/")) or project == "ALL":
-                    item.setHidden(False)
-                    root_hidden = False
-                else:
-                    item.setHidden(True)
-            root_item.setHidden(root_hidden)
+        project = vehicles.code(self.vehicle_combo.currentText())
+        elm.addressing.load(vehicles.project(self.vehicle_combo.currentText()))
+        self.model.set_filter(project, self.search.text())
+
+    def searchEcu(self, text):
+        project = vehicles.code(self.vehicle_combo.currentText())
+        self.model.set_filter(project, text)
 
     def ecuSel(self, index):
         if index.parent() == core.QModelIndex():
@@ -292,20 +460,11 @@ class Main_widget(widgets.QMainWindow):
         self.ecunamemap = {}
         self.plugins = {}
         self.setWindowTitle(version.__appname__ + " - Version: " + version.__version__ + " - Build status: " + version.__status__)
-        self.ecu_scan = ecu.Ecu_scanner()
+        # The database is loaded in the background, see databaseLoaded
+        self.ecu_scan = ecu.Ecu_scanner(background=True)
         self.ecu_scan.qapp = app
         options.socket_timeout = False
         options.ecu_scanner = self.ecu_scan
-        print(str(self.ecu_scan.getNumEcuDb()) + " " + _("loaded ECUs in database."))
-        if self.ecu_scan.getNumEcuDb() == 0:
-            msgbox = widgets.QMessageBox()
-            appIcon = gui.QIcon("ddt4all_data/icons/obd.png")
-            msgbox.setWindowIcon(appIcon)
-            msgbox.setWindowTitle(version.__appname__)
-            msgbox.setIcon(widgets.QMessageBox.Warning)
-            msgbox.setText(_("No database found"))
-            msgbox.setInformativeText(_("Check documentation"))
-            msgbox.exec_()
 
         self.paramview = None
         
@@ -388,6 +547,12 @@ class Main_widget(widgets.QMainWindow):
         self.statusBar.addWidget(self.cantimeout)
         self.statusBar.addWidget(self.infostatus)
 
+        self.progressstatus.setRange(0, 0)
+        self.infostatus.setText(_("Loading ECU database..."))
+        self.databasetimer = core.QTimer()
+        self.databasetimer.timeout.connect(self.databaseLoaded)
+        self.databasetimer.start(100)
+
         self.tabbedview = widgets.QTabWidget()
         self.setCentralWidget(self.tabbedview)
 
@@ -633,6 +798,37 @@ class Main_widget(widgets.QMainWindow):
         self.tabbedview.setCurrentIndex(1)
         self.showMaximized()
 
+    def databaseLoaded(self):
+        if not self.ecu_scan.database_ready():
+            return
+        self.databasetimer.stop()
+        self.progressstatus.setRange(0, 100)
+        self.progressstatus.reset()
+        self.infostatus.setText("")
+
+        error = self.ecu_scan.database_future.exception()
+        if error is not None:
+            print(_("ECU database loading failed : ") + str(error))
+            self.logview.append(_("ECU database loading failed : ") + str(error))
+        else:
+            print(str(self.ecu_scan.getNumEcuDb()) + " " + _("loaded ECUs in database."))
+            self.logview.append(_("ECU database loaded in %.2f s") % self.ecu_scan.database_load_time)
+            self.eculistwidget.init()
+        if error is not None or self.ecu_scan.getNumEcuDb() == 0:
+            msgbox = widgets.QMessageBox()
+            appIcon = gui.QIcon("ddt4all_data/icons/obd.png")
+            msgbox.setWindowIcon(appIcon)
+            msgbox.setWindowTitle(version.__appname__)
+            msgbox.setIcon(widgets.QMessageBox.Warning)
+            msgbox.setText(_("No database found"))
+            msgbox.setInformativeText(_("Check documentation"))
+            msgbox.exec_()
+
+    def windowShown(self, start):
+        text = _("Main window shown in %.2f s") % (time.time() - start)
+        print(text)
+        self.logview.append(text)
+
     def about_content_msg(self):
         msgbox = widgets.QMessageBox()
         appIcon = gui.QIcon("ddt4all_data/icons/obd.png")
@@ -1128,7 +1324,8 @@ class Main_widget(widgets.QMainWindow):
 
     def closeEvent(self, event):
         if self.paramview:
-            self.paramview.tester_timer.stop()
+            self.paramview.tester_presend_command = ""
+            self.paramview.update_tester_present()
         self.snifferview.stopthread()
         super(Main_widget, self).closeEvent(event)
         try:
@@ -1203,6 +1400,9 @@ class Main_widget(widgets.QMainWindow):
                                                 self.protocolstatus, self.canlinecombo.currentIndex())
         self.paramview.infobox = self.infostatus
         if options.simulation_mode:
+            if self.paramview.ecurequestsparser:
+                # Editors walk and modify the whole file
+                self.paramview.ecurequestsparser.materialize()
             self.requesteditor.set_ecu(self.paramview.ecurequestsparser)
             self.dataitemeditor.set_ecu(self.paramview.ecurequestsparser)
             self.buttonEditor.set_ecu(self.paramview.ecurequestsparser)
@@ -1970,6 +2170,7 @@ if __name__ == '__main__':
             msgbox.exec_()
 
         print(_("Initilizing ELM with speed %i...") % port_speed)
+        elm.release_elm()
         options.elm = elm.ELM(options.port, port_speed, pc.adapter, pc.raise_port_speed)
         if options.elm_failed:
             pc.show()
@@ -1983,8 +2184,11 @@ if __name__ == '__main__':
         else:
             nok = False
 
+    window_start = time.time()
     w = Main_widget()
     options.main_window = w
     w.show()
+    # Runs once the event loop has shown the window
+    core.QTimer.singleShot(0, lambda: w.windowShown(window_start))
     app.exec_()
 
@@ -13,7 +13,7 @@ promode = False
 elm = None
 log = "ddt"
 opt_cfc0 = False
-opt_n1c = True
+opt_n1c = False  # True disables the ISO-TP frame count hints (L1 cache)
 log_all = False
 auto_refresh = False
 elm_failed = False
@@ -235,11 +235,6 @@ class paramWidget(widgets.QWidget):
         self.currentwidget = None
         self.timer = core.QTimer()
         self.timer.setSingleShot(True)
-        self.tester_timer = core.QTimer()
-        self.tester_timer.setSingleShot(False)
-        self.tester_timer.setInterval(1500)
-        self.tester_timer.timeout.connect(self.tester_send)
-        self.tester_timer.start()
         self.tester_presend_command = ""
         self.initXML()
         self.sliding = False
@@ -256,15 +251,10 @@ class paramWidget(widgets.QWidget):
         if options.elm is not None:
             options.elm.ATCFC0 = b
 
-    def tester_send(self):
-        if self.tester_presend_command == "":
-            return
-
-        # No need to send "tester_present" command if we're auto updating
-        if options.auto_refresh:
-            return
-
-        self.sendElm(self.tester_presend_command, True)
+    def update_tester_present(self):
+        # Sent from the ELM thread whenever the bus stays idle, so not while auto updating
+        if options.elm is not None and not options.simulation_mode:
+            options.elm.set_tester_present(self.tester_presend_command)
 
     def saveEcu(self, name=None):
         if not name:
@@ -296,6 +286,9 @@ class paramWidget(widgets.QWidget):
             jsfile.write(json.dumps(self.layoutdict))
             jsfile.close()
 
+        # Next users must reload the saved file
+        ecu.invalidate_ecu_file(filename)
+
         target_name = filename + ".targets"
         if self.targetsdata:
             js = json.dumps(self.targetsdata, indent=1)
@@ -719,6 +712,11 @@ class paramWidget(widgets.QWidget):
             self.logview.append("<font color='red'>" + _("Protocol not supported") + "</font>")
             return
 
+        if not options.simulation_mode:
+            options.elm.set_calibration_reads(self.ecurequestsparser.get_calibration_reads())
+            # A reconnection gives a new device, without the tester present thread
+            self.update_tester_present()
+
         if self.main_protocol_status:
             if self.ecurequestsparser.ecu_protocol == "CAN":
                 self.startDiagnosticSession()
@@ -744,9 +742,8 @@ class paramWidget(widgets.QWidget):
             jsondata = jsfile.read()
             jsfile.close()
         else:
-            zf = zipfile.ZipFile("ecu.zip", mode='r')
             layoutfile = self.ddtfile[5:] + ".layout"
-            jsondata = zf.read(layoutfile)
+            jsondata = ecu.ecu_zip.read(layoutfile)
         if os.path.exists(targetsfile):
             jsfile = open(targetsfile, "r")
             self.targetsdata = json.loads(jsfile.read())
@@ -774,18 +771,25 @@ class paramWidget(widgets.QWidget):
         self.xmlscreen = {}
         self.parser = ''
         self.tester_presend_command = ""
+        self.update_tester_present()
         self.movingwidgets = []
         self.sliding = False
         self.sds = {}
         options.main_window.sdsready = False
         options.main_window.sdscombo.clear()
 
+    def load_ecu_file(self):
+        # The editors modify the file in simulation mode, they get a private copy
+        if options.simulation_mode:
+            return ecu.Ecu_file(self.ddtfile, True)
+        return ecu.get_ecu_file(self.ddtfile)
+
     def initXML(self):
         self.clearAll()
 
         if '.json' in self.ddtfile:
             self.parser = 'json'
-            self.ecurequestsparser = ecu.Ecu_file(self.ddtfile, True)
+            self.ecurequestsparser = self.load_ecu_file()
             self.initJSON()
         else:
             self.parser = 'xml'
@@ -796,7 +800,7 @@ class paramWidget(widgets.QWidget):
                 print(_("XML file not found : ") + self.ddtfile)
                 return
 
-            self.ecurequestsparser = ecu.Ecu_file(self.ddtfile, True)
+            self.ecurequestsparser = self.load_ecu_file()
 
             target = self.getChildNodesByName(xdoc, u"Target")[0]
             if not target:
@@ -826,9 +830,10 @@ class paramWidget(widgets.QWidget):
         self.sds["After sales (default) [10C0]"] = "10C0"
 
         # Init startDiagnosticSession combo
-        for reqname, request in self.ecurequestsparser.requests.items():
+        for reqname in self.ecurequestsparser.requests.keys():
             uppername = reqname.upper()
             if "START" in uppername and "DIAG" in uppername and "SESSION" in uppername:
+                request = self.ecurequestsparser.requests[reqname]
                 sessionnamefound = False
                 for di in request.sendbyte_dataitems.keys():
                     dataitemnameupper = di.upper()
@@ -865,8 +870,9 @@ class paramWidget(widgets.QWidget):
                 if "tester" in k.lower() and "present" in k.lower():
                     self.tester_presend_command = self.ecurequestsparser.requests[k].sentbytes
                     break
+            self.update_tester_present()
 
-    def sendElm(self, command, auto=False, force=False):
+    def sendElm(self, command, auto=False, force=False, cache=False):
         if isinstance(command, bytes):
             command = command.decode("utf-8")
         elif not isinstance(command, str):
@@ -894,14 +900,15 @@ class paramWidget(widgets.QWidget):
             if not force and not options.promode:
                 # Allow read only modes
                 if command[0:2] in options.safe_commands:
-                    elm_response = options.elm.request(command, cache=False)
+                    # Only screen refresh reads are cached, for what get_cache_ttl allows
+                    elm_response = options.elm.request(command, cache=cache)
                     txt = '<font color=blue>' + _('Sending ELM request :') + '</font>'
                 else:
                     txt = '<font color=green>' + _('Blocked ELM request :') + '</font>'
                     elm_response = "BLOCKED"
             else:
                 # Pro mode *Watch out*
-                elm_response = options.elm.request(command, cache=False)
+                elm_response = options.elm.request(command, cache=cache)
                 txt = '<font color=red>' + _('Sending ELM request:') + '</font>'
         else:
             if "1902" in command:
@@ -1202,11 +1209,12 @@ class paramWidget(widgets.QWidget):
             if blocked:
                 return
 
+            if request_name in self.displaydict:
+                rcv_values = ecu_request.get_values_from_stream(elm_response)
             for key in rcvbytes_data_items.keys():
                 if request_name in self.displaydict:
-                    data_item = rcvbytes_data_items[key]
                     dd_ecu_data = self.ecurequestsparser.data[key]
-                    value = dd_ecu_data.getDisplayValue(elm_response, data_item, self.ecurequestsparser.endianness)
+                    value = rcv_values[key]
                     dd_request_data = self.displaydict[request_name]
                     data = dd_request_data.getDataByName(key)
 
@@ -1330,7 +1338,10 @@ class paramWidget(widgets.QWidget):
         elapsed_time = time.time() - start_time
         if self.infobox:
             text = _("Update time")
-            self.infobox.setText(f'{text} {elapsed_time * 1000.0:.3f} ms')
+            info = f'{text} {elapsed_time * 1000.0:.3f} ms'
+            if not options.simulation_mode and options.elm is not None:
+                info += f' ({options.elm.request_rate():.1f} ' + _("requests/s") + ')'
+            self.infobox.setText(info)
         # Stop log
         self.updatelog = False
         if options.auto_refresh:
@@ -1344,19 +1355,21 @@ class paramWidget(widgets.QWidget):
             return
 
         ecu_bytes_to_send = request.sentbytes.encode('ascii')
-        elm_response = self.sendElm(ecu_bytes_to_send, True)
+        elm_response = self.sendElm(ecu_bytes_to_send, True, cache=True)
 
         # Test data for offline test, below is UCT_X84 (roof) parameter misc timings and values
         # elm_response = "61 0A 16 32 32 02 58 00 B4 3C 3C 1E 3C 0A 0A 0A 0A 01 2C 5C 61 67 B5 BB C1 0A 5C"
         # Test data for DAE_X84
         # elm_response = "61 01 0E 0E FF FF 70 00 00 00 00 01 11 64 00 00 EC 00 00 00"
         # elm_response = "61 08 F3 0C 48 00 00 00 00 F3 0C 48 00 00 00 00 00 00 00 00 00 00 00 FF 48 FF FF"
+        data_names = [data_struct.data.name for data_struct in request_data.data]
+        values = request.get_values_from_stream(elm_response, data_names)
         logdict = {}
         for data_struct in request_data.data:
             qlabel = data_struct.widget
             ecu_data = data_struct.data
             data_item = request.dataitems[ecu_data.name]
-            value = ecu_data.getDisplayValue(elm_response, data_item, request.ecu_file.endianness)
+            value = values[ecu_data.name]
 
             if value is None:
                 qlabel.setStyleSheet("background-color: red;color: black")
@@ -1633,7 +1646,7 @@ def dumpXML(xmlname):
 def dumpAddressing(file):
     xdom = xml.dom.minidom.parse(file)
     xdoc = xdom.documentElement
-    dict = ecu.addressing
+    dict = elm.addressing.groups.copy()
     xml_funcs = getChildNodesByName(xdoc, u"Function")
     for func in xml_funcs:
         shortname = func.getAttribute(u"Name")
@@ -1656,7 +1669,7 @@ def dumpAddressing(file):
 def dumpSNAT(file):
     xdom = xml.dom.minidom.parse(file)
     xdoc = xdom.documentElement
-    dict = elm.snat
+    dict = elm.addressing.snat.copy()
     xml_funcs = getChildNodesByName(xdoc, u"Function")
     for func in xml_funcs:
         address = func.getAttribute(u"Address")
@@ -1678,7 +1691,7 @@ def dumpSNAT(file):
 def dumpSNAT_ext(file):
     xdom = xml.dom.minidom.parse(file)
     xdoc = xdom.documentElement
-    dict = elm.snat_ext
+    dict = elm.addressing.snat_ext.copy()
     xml_funcs = getChildNodesByName(xdoc, u"Function")
     for func in xml_funcs:
         address = func.getAttribute(u"Address")
@@ -1700,7 +1713,7 @@ def dumpSNAT_ext(file):
 def dumpDNAT(file):
     xdom = xml.dom.minidom.parse(file)
     xdoc = xdom.documentElement
-    dict = elm.dnat
+    dict = elm.addressing.dnat.copy()
     xml_funcs = getChildNodesByName(xdoc, u"Function")
     for func in xml_funcs:
         address = func.getAttribute(u"Address")
@@ -1722,7 +1735,7 @@ def dumpDNAT(file):
 def dumpDNAT_ext(file):
     xdom = xml.dom.minidom.parse(file)
     xdoc = xdom.documentElement
-    dict = elm.dnat_ext
+    dict = elm.addressing.dnat_ext.copy()
     xml_funcs = getChildNodesByName(xdoc, u"Function")
     for func in xml_funcs:
         address = func.getAttribute(u"Address")
@@ -179,7 +179,7 @@ class sniffer(widgets.QWidget):
                 i += 1
 
     def init(self):
-        self.ecurequests = ecu.Ecu_file(self.ecu_file, True)
+        self.ecurequests = ecu.get_ecu_file(self.ecu_file)
         self.framecombo.clear()
         self.table.clear()
         self.table.setRowCount(0)
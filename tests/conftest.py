@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The modules read and write ddt4all_data/ in the working directory, keep the tree clean
+workdir = tempfile.mkdtemp(prefix="ddt4all_tests_")
+os.makedirs(os.path.join(workdir, "ddt4all_data"))
+os.chdir(workdir)
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import ecu
+
+
+def write_ecu_file(path, data_names):
+    content = {
+        "endian": "Big",
+        "devices": [],
+        "requests": [{
+            "name": "ReadValues",
+            "sentbytes": "2101",
+            "replybytes": "6101",
+            "receivebyte_dataitems": {name: {"firstbyte": 3 + i} for i, name in enumerate(data_names)},
+        }],
+        "data": {name: {"bitscount": 8, "scaled": True} for name in data_names},
+    }
+    with open(path, "w") as f:
+        f.write(json.dumps(content))
+    return str(path)
+
+
+def test_decoder_follows_replaced_data(tmp_path):
+    ecu_file = ecu.Ecu_file(write_ecu_file(tmp_path / "test.json", ["A", "B"]), True)
+    request = ecu_file.requests["ReadValues"]
+    assert request.get_values_from_stream("61 01 0A 0B") == {"A": "10", "B": "11"}
+
+    # Editors replace the data objects, the decoder must not keep the old ones
+    ecu_file.data["A"] = ecu.Ecu_data({"bitscount": 8, "scaled": True, "step": 2}, "A")
+    assert request.get_values_from_stream("61 01 0A 0B")["A"] == "20"
+
+
+def iter_cases(bitscount, dataitem):
+    # Every bit position of the first three bytes, with a few values
+    for firstbyte in range(1, 4):
+        for bitoffset in range(8):
+            dataitem.firstbyte = firstbyte
+            dataitem.bitoffset = bitoffset
+            for value in (0, 1, 0x5A5A5A5A & ((1 << bitscount) - 1), (1 << bitscount) - 1):
+                yield value
+
+
+@pytest.mark.parametrize("endian", ["Big", "Little"])
+@pytest.mark.parametrize("bitscount", [1, 3, 8, 12, 16, 21, 32])
+def test_plans_match_string_implementations(endian, bitscount):
+    data = ecu.Ecu_data(None, 'test')
+    data.bitscount = bitscount
+    dataitem = ecu.Data_item({}, '', 'test')
+    dataitem.endian = endian
+    for value in iter_cases(bitscount, dataitem):
+        stream = ["A5"] * 10
+        written = data.setValue("%X" % value, list(stream), dataitem, '')
+        assert written == data.setValueToString(value, list(stream), dataitem, endian == "Little")
+        data_bytes = bytearray.fromhex(" ".join(stream))
+        data.setValueBytes("%X" % value, data_bytes, dataitem, '')
+        assert data_bytes.hex().upper() == "".join(written)
+
+        response = " ".join(written)
+        assert data.getHexValue(response, dataitem, '') == data.getHexValueFromString(response, dataitem, '')
+
+
+@pytest.mark.parametrize("bitscount", [1, 3, 8, 12, 16, 21, 32])
+def test_insertion_extraction_round_trip(bitscount):
+    data = ecu.Ecu_data(None, 'test')
+    data.bitscount = bitscount
+    dataitem = ecu.Data_item({}, '', 'test')
+    dataitem.endian = "Big"
+    for value in iter_cases(bitscount, dataitem):
+        written = data.setValue("%X" % value, ["A5"] * 10, dataitem, '')
+        assert data.getIntValue(" ".join(written), dataitem, '') == value
+        # The bits around the value are left alone
+        mask = ((1 << bitscount) - 1) << (80 - (dataitem.firstbyte - 1) * 8 - dataitem.bitoffset - bitscount)
+        assert int("".join(written), 16) & ~mask == int("A5" * 10, 16) & ~mask
+
+
+def test_lazy_dict_builds_on_first_access():
+    built = []
+
+    def factory(key, value):
+        built.append(key)
+        return value * 2
+
+    lazy = ecu.Ecu_lazy_dict({"a": 1, "b": 2, "c": 3}, factory)
+    assert "a" in lazy and len(lazy) == 3 and sorted(lazy.keys()) == ["a", "b", "c"]
+    assert built == []
+
+    assert lazy["b"] == 4 and lazy["b"] == 4
+    assert built == ["b"]
+
+    lazy["c"] = 10
+    assert lazy["c"] == 10
+    del lazy["a"]
+    assert "a" not in lazy
+
+    lazy["d"] = 5
+    lazy.materialize()
+    assert dict(lazy) == {"b": 4, "c": 10, "d": 5}
+    assert built == ["b"]
+
+
+def test_lazy_ecu_file(tmp_path):
+    ecu_file = ecu.Ecu_file(write_ecu_file(tmp_path / "test.json", ["A", "B"]), True)
+    assert isinstance(ecu_file.data, ecu.Ecu_lazy_dict)
+    assert ecu_file.data.pending == {"A", "B"}
+    ecu_file.requests["ReadValues"].get_values_from_stream("61 01 0A 0B", ["A"])
+    assert "A" not in ecu_file.data.pending
+
+    eager = ecu.Ecu_file(write_ecu_file(tmp_path / "test.json", ["A", "B"]), True, lazy=False)
+    assert sorted(eager.data) == ["A", "B"]
+    assert isinstance(eager.data["B"], ecu.Ecu_data)
@@ -0,0 +1,192 @@
+import json
+import time
+
+import elm
+import options
+
+
+def make_elm(**attributes):
+    # An ELM without adapter, for the logic that does not talk to it
+    device = elm.ELM.__new__(elm.ELM)
+    for name, value in attributes.items():
+        setattr(device, name, value)
+    return device
+
+
+def test_frame_hints_are_saved_once(tmp_path):
+    filename = str(tmp_path / "frame_hints.json")
+    hints = elm.Frame_hints(filename)
+    hints.set("7E0", "2101", 3)
+    hints.set("7E0", "2102", 1)
+    assert hints.get("7E0", "2101") == 3
+    # Nothing written in the request path until frame_hints_save_delay has passed
+    assert not (tmp_path / "frame_hints.json").exists()
+
+    hints.saved -= elm.frame_hints_save_delay
+    hints.discard("7E0", "2102")
+    with open(filename) as f:
+        assert json.load(f)["hints"] == {"7E0": {"2101": 3}}
+    assert not hints.dirty
+
+    hints.set("7E0", "2101", 2)
+    hints.save()
+    assert elm.Frame_hints(filename).get("7E0", "2101") == 2
+
+
+def test_frame_hints_ignore_other_versions(tmp_path):
+    filename = tmp_path / "frame_hints.json"
+    filename.write_text(json.dumps({"version": elm.frame_hints_version + 1, "hints": {"7E0": {"2101": 3}}}))
+    assert elm.Frame_hints(str(filename)).get("7E0", "2101") is None
+
+
+def test_cache_ttl_by_request_class():
+    device = make_elm(currentaddress="7A", calibration_reads={"7A": {"2101"}})
+    assert device.get_cache_ttl("22F190") is None
+    assert device.get_cache_ttl("2180") is None
+    assert device.get_cache_ttl("2101") == elm.cache_ttl["calibration"]
+    assert device.get_cache_ttl("2102") == elm.cache_ttl["live"]
+
+
+def test_cache_invalidated_by_writes():
+    device = make_elm(currentaddress="7A")
+    device.rsp_cache = {("7A", "22F190"): (None, "62 F1 90"), ("7A", "2101"): (None, "61 01"),
+                        ("7A", "2102"): (None, "61 02"), ("26", "2101"): (None, "61 01")}
+    device.invalidate_cache("2EF1900102")
+    assert ("7A", "22F190") not in device.rsp_cache
+    device.invalidate_cache("3B0155")
+    assert ("7A", "2101") not in device.rsp_cache
+    assert ("7A", "2102") in device.rsp_cache
+
+    device.invalidate_cache("1101")
+    assert list(device.rsp_cache) == [("26", "2101")]
+
+
+def test_latency_percentile():
+    tracker = elm.Latency_tracker()
+    for i in range(elm.latency_min_samples - 1):
+        tracker.add("7E0", 0.01)
+    assert tracker.percentile("7E0") is None
+    assert tracker.timeout_value("7E0") is None
+
+    tracker.reset("7E0")
+    for i in range(100):
+        tracker.add("7E0", (i + 1) / 1000.)
+    # Only the last latency_samples are kept
+    assert tracker.percentile("7E0") == 0.098
+    # 98 ms and the 30 ms margin, in 4 ms steps
+    assert tracker.timeout_value("7E0") == 32
+
+
+def test_latency_backoff_decays():
+    tracker = elm.Latency_tracker()
+    for i in range(elm.latency_min_samples):
+        tracker.add("7E0", 0.02)
+    base = tracker.timeout_value("7E0")
+    for i in range(5):
+        tracker.backoff("7E0")
+    assert tracker.backoffs["7E0"] == elm.latency_max_backoff
+    assert tracker.timeout_value("7E0") > base
+
+    for i in range(elm.latency_backoff_decay * 3):
+        tracker.add("7E0", 0.02)
+    assert "7E0" not in tracker.backoffs
+    assert tracker.timeout_value("7E0") == base
+
+
+def test_can_timeout_follows_option(monkeypatch):
+    device = make_elm(currentsendid="7E0", latency=elm.Latency_tracker())
+    device.cmd = lambda command: ""
+    for i in range(elm.latency_min_samples):
+        device.latency.add("7E0", 0.02)
+
+    monkeypatch.setattr(options, "cantimeout", 200)
+    device.set_can_timeout(options.cantimeout)
+    assert device.get_adaptive_timeout("2101") is None
+    device.set_can_timeout(1500)
+    monkeypatch.setattr(options, "cantimeout", 0)
+    assert device.get_adaptive_timeout("2101") is None
+    device.set_can_timeout(options.cantimeout)
+    assert device.get_adaptive_timeout("2101") == device.latency.timeout_value("7E0")
+
+    # Back to AUTO without the adapter being told, the adaptation resumes too
+    monkeypatch.setattr(options, "cantimeout", 200)
+    device.set_can_timeout(options.cantimeout)
+    monkeypatch.setattr(options, "cantimeout", 0)
+    assert device.get_adaptive_timeout("2101") is not None
+
+
+def test_pacer_backs_off_and_recovers():
+    pacer = elm.Pacer()
+    pacer.update("7A", "7F 21 21")
+    assert pacer.gaps["7A"] == elm.pacing_step
+    pacer.update("7A", "BUFFER FULL")
+    assert pacer.gaps["7A"] == elm.pacing_step * 2
+    for i in range(10):
+        pacer.update("7A", "037F2121")
+    assert pacer.gaps["7A"] == elm.pacing_max_gap
+
+    for i in range(elm.pacing_decay):
+        pacer.update("7A", "61 01 00")
+    assert pacer.gaps["7A"] == elm.pacing_max_gap / 2
+    for i in range(elm.pacing_decay * 10):
+        pacer.update("7A", "61 01 00")
+    assert "7A" not in pacer.gaps
+
+
+def test_pacer_waits_for_the_gap():
+    pacer = elm.Pacer()
+    pacer.gaps["7A"] = 0.05
+    pacer.last_response = time.time()
+    start = time.time()
+    pacer.wait("7A", "can", 0.)
+    assert time.time() - start >= 0.04
+    start = time.time()
+    pacer.wait("26", "can", 0.)
+    assert time.time() - start < 0.02
+
+
+class Fake_port:
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def read_until(self, pattern, time_out=1, crlf=False):
+        if not self.lines:
+            return b'>', True
+        return (self.lines.pop(0) + "\r").encode('latin1'), True
+
+    def expect(self, pattern, time_out=1):
+        return ">"
+
+
+def test_pending_frames():
+    assert elm.is_pending_frame("037F2278")
+    assert not elm.is_pending_frame("037F2231")
+    assert not elm.is_pending_frame("0462F190")
+
+
+def test_final_response_given_by_the_elm():
+    device = make_elm(port=Fake_port([]))
+    responses = ["0462F19001"]
+    assert device.get_final_responses(responses, time.time(), False) is responses
+    assert device.get_final_responses(["037F2278", "0462F19001"], time.time(), False) == ["0462F19001"]
+    assert device.port.written == []
+
+
+def test_final_response_read_from_the_bus(monkeypatch):
+    monkeypatch.setattr(options, "simulation_mode", False)
+    device = make_elm(port=Fake_port(["037F2278", "0462F19001"]))
+    assert device.get_final_responses(["037F2278"], time.time(), False) == ["0462F19001"]
+    assert device.port.written == [b"AT MA\r", b"AT\r"]
+
+    # Multi frame final response, the flow control is sent once monitoring stopped
+    device = make_elm(port=Fake_port(["100862F190010203"]))
+    device.send_raw = lambda command: "300000\n21040506\n>" if command == "300000" else ""
+    assert device.get_final_responses(["037F2278"], time.time(), True) == ["100862F190010203", "21040506"]
+
+    # No final response at all, the pending one is returned
+    device = make_elm(port=Fake_port([]))
+    assert device.get_final_responses(["037F2278"], time.time(), False) == ["037F2278"]
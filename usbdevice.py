@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 import array
+import threading
 import time
 
 from usb import util, core, legacy
@@ -167,10 +168,13 @@ class UsbCan:
             return b''
 
     def get_data(self, length=511):
+        return " ".join([hex(b)[2:].upper().zfill(2) for b in self.get_data_bytes(length)])
+
+    def get_data_bytes(self, length=511):
         response = self.device.ctrl_transfer(bmRequestType=REQUEST_TYPE_RECV,
                                              bRequest=USBRQ_HID_GET_REPORT,
                                              data_or_wLength=length)
-        return " ".join([hex(b)[2:].upper().zfill(2) for b in response])
+        return bytes(response)
 
     def set_data(self, data):
         response = self.device.ctrl_transfer(bmRequestType=REQUEST_TYPE_SEND,
@@ -188,16 +192,28 @@ class UsbCan:
         return length
 
     def get_buffer(self, timeout=500):
+        response = self.get_buffer_bytes(timeout)
+        if response.status == elm.Response.FRAMING:
+            return ("WRONG RESPONSE")
+        if response.status == elm.Response.TIMEOUT:
+            return ("TIMEOUT")
+        return " ".join([hex(b)[2:].upper().zfill(2) for b in response.data])
+
+    def get_buffer_bytes(self, timeout=500):
         start = time.time()
         while 1:
             leng = self.get_read_buffer_length()
             if leng == -1:
-                return ("WRONG RESPONSE")
+                return elm.Response(elm.Response.FRAMING, text="WRONG RESPONSE")
             if leng > 0:
                 break
             if time.time() - start > timeout / 1000:
-                return ("TIMEOUT")
-        return self.get_data(leng)
+                return elm.Response(elm.Response.TIMEOUT, text="TIMEOUT")
+
+        data = self.get_data_bytes(leng)
+        if len(data) >= 3 and data[0] == 0x7F:
+            return elm.Response(elm.Response.NEGATIVE, data, data[2])
+        return elm.Response(elm.Response.POSITIVE, data)
 
     def set_tx_addr(self, addr):
         self.set_vendor_request(VENDOR_CAN_TX, addr)
@@ -228,6 +244,9 @@ class OBDDevice:
         self.currentaddress = 0x00
         self.startSession = ""
         self.rsp_cache = {}
+        self.lock = threading.RLock()
+        self.lastCMDtime = 0
+        self.tester_present = None
         self.device_type = self.device.device_type
         
         # Get device-specific settings
@@ -235,10 +254,23 @@ class OBDDevice:
 
     def request(self, req, positive='', cache=True, serviceDelay="0"):
         req_as_bytes = array.array('B', [int("0x" + a, 16) for a in req.split(" ")])
-        self.device.set_data(req_as_bytes)
-        # Use device-specific timeout from settings
-        timeout_ms = int(self.settings.get('timeout', 4) * 1000)  # Convert to milliseconds
-        return self.device.get_buffer(timeout_ms)
+        with self.lock:
+            self.device.set_data(req_as_bytes)
+            # Use device-specific timeout from settings
+            timeout_ms = int(self.settings.get('timeout', 4) * 1000)  # Convert to milliseconds
+            rsp = self.device.get_buffer(timeout_ms)
+            self.lastCMDtime = time.time()
+            return rsp
+
+    def request_bytes(self, req, positive='', cache=True, serviceDelay="0"):
+        if not isinstance(req, (bytes, bytearray)):
+            req = bytes.fromhex(req)
+        with self.lock:
+            self.device.set_data(array.array('B', req))
+            timeout_ms = int(self.settings.get('timeout', 4) * 1000)
+            rsp = self.device.get_buffer_bytes(timeout_ms)
+            self.lastCMDtime = time.time()
+            return rsp
 
     def close_protocol(self):
         pass
@@ -271,6 +303,24 @@ class OBDDevice:
         '''
         self.rsp_cache = {}
 
+    def set_calibration_reads(self, reads):
+        pass
+
+    def request_rate(self):
+        return 0.
+
+    def set_tester_present(self, command):
+        if self.tester_present is not None:
+            self.tester_present.stop()
+            self.tester_present = None
+        if command:
+            self.tester_present = elm.Tester_present(self, command.replace(' ', '').upper())
+            self.tester_present.start()
+
+    def send_tester_present(self, command):
+        # The device handles the ISO-TP framing, the response is just dropped
+        return self.request(' '.join(command[i:i + 2] for i in range(0, len(command), 2)))
+
     def set_can_addr(self, addr, ecu, canline=0):
         if 'idTx' in ecu and 'idRx' in ecu:
             TXa = ecu['idTx']